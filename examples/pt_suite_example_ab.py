@@ -125,7 +125,7 @@ def main():
     op.add_option("-t", "--time", default=5, type=int,
                   help="limit every test by given time (sec), default %default")
 
-    suite = ptSuite(suite_ver="1.0.0", product_name="My web site", product_ver="1.0-1234")
+    suite = ptSuite(suite_ver="1.0.0", product_name="My web site", product_ver="1.0-1234", async_upload=True)
     suite.addOptions(op)
 
     opts, urls = op.parse_args()
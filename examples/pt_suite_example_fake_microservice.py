@@ -97,7 +97,7 @@ if __name__ == "__main__":
     op = OptionParser("PerfTracker suite example")
     op.add_option("-v", "--verbose", action="store_true", help="enable verbose mode")
 
-    suite = ptSuite(suite_ver="1.0.0", product_name="Account Server", product_ver="1.0-1234")
+    suite = ptSuite(suite_ver="1.0.0", product_name="Account Server", product_ver="1.0-1234", async_upload=True)
     suite.addOptions(op)
 
     opts, args = op.parse_args()
@@ -17,30 +17,71 @@ import logging
 import pipes
 import subprocess
 import bz2
+import zlib
+import array
+import bisect
 import random
+import time
+import email.utils
+import threading
+import atexit
 import citizenshell
 import ast
 from math import sqrt
 from dateutil import parser
+from requests.adapters import HTTPAdapter
 
 from optparse import OptionParser, OptionGroup
 
 from perftrackerlib.helpers.tee import Tee
 from perftrackerlib.helpers.decorators import cached_property
 from perftrackerlib.helpers.ptshell import ptShell, ptShellFromFile
+from perftrackerlib.helpers.spool import Spool
+from perftrackerlib.helpers.sketch import QuantileSketch
 
 from dateutil.tz import tzlocal
 from collections import OrderedDict
 
+_PY2 = sys.version_info < (3, 0)
+
 if sys.version_info >= (3, 0):
     import http.client as httplib
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
 else:
     import httplib
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 API_VER = '1.0'
 PT_SERVER_DEFAULT_URL = "http://127.0.0.1:9000"
 
 TEST_STATUSES = ['NOTTESTED', 'SKIPPED', 'INPROGRESS', 'SUCCESS', 'FAILED']
+# status of the merged test runs is the one having the max priority
+_TEST_STATUS_MERGE_PRIORITY = {'NOTTESTED': 0, 'SKIPPED': 1, 'SUCCESS': 2, 'INPROGRESS': 3, 'FAILED': 4}
+
+RESULTS_FORMAT_VERSION = 1
+
+# 429 Too Many Requests, 502 Bad Gateway, 503 Service Unavailable, 504 Gateway Timeout
+RETRY_HTTP_STATUSES = (429, 502, 503, 504)
+IDEMPOTENT_HTTP_METHODS = ('get', 'head', 'options', 'put', 'delete')
+
+COMPRESSION_CODECS = ('gzip', 'zstd')
 
 
 def pt_float(value):
@@ -59,6 +100,87 @@ def pt_float(value):
     return float(fmt % (val)) * (1 if value > 0 else -1)
 
 
+# the pt_float() precision thresholds: 100, 10.0, 1.0, 0.1, ... computed the same way, ascending
+_pt_float_thr = [100.0]
+while len(_pt_float_thr) < 16:
+    _pt_float_thr.append(_pt_float_thr[-1] / 10.0)
+_pt_float_thr.reverse()
+
+
+def pt_float_many(values):
+    """
+    Vectorized pt_float(), returns array('d') of the values rounded exactly like pt_float() does
+    """
+    if numpy is not None:
+        return _pt_float_many_numpy(values)
+
+    ret = []
+    append = ret.append
+    thr = _pt_float_thr
+    n = len(thr)
+    bisect_right = bisect.bisect_right
+    for value in values:
+        if value > 100 or value < -100:
+            append(round(value))
+        elif value < 0.00000001:
+            append(0.0)
+        else:
+            val = float(value)
+            append(float("%.*f" % (n - bisect_right(thr, val), val)))
+    return array.array('d', ret)
+
+
+def _pt_float_many_numpy(values):
+    if not isinstance(values, (list, tuple, array.array, numpy.ndarray)):
+        values = list(values)  # i.e. generator
+    v = numpy.asarray(values, dtype=numpy.float64)
+    ret = numpy.zeros(v.shape, dtype=numpy.float64)
+
+    big = (v > 100) | (v < -100)
+    ret[big] = numpy.rint(v[big])
+
+    mid = ~big & (v >= 0.00000001)
+    val = v[mid]
+    prec = len(_pt_float_thr) - numpy.searchsorted(_pt_float_thr, val, side='right')
+    scale = numpy.power(10.0, prec)  # exact for prec < 23
+    scaled = val * scale
+    rounded = numpy.rint(scaled) / scale
+
+    # val * scale is inexact, so the values too close to .5 may be rounded in the wrong direction
+    # (or are exact ties which "%f" and rint may break differently), round them one by one
+    frac = scaled - numpy.floor(scaled)
+    for i in numpy.nonzero(numpy.abs(frac - 0.5) < 1e-6)[0]:
+        rounded[i] = pt_float(val[i])
+    ret[mid] = rounded
+
+    bad = ~numpy.isfinite(v)
+    if bad.any():
+        ret[bad] = [pt_float(x) for x in v[bad]]  # same nan and OverflowError behaviour as pt_float()
+
+    return array.array('d', ret.tobytes())
+
+
+def _pt_merge_counters(a, b):
+    """
+    Merge loops, errors or warnings: None, counter or list of messages
+    """
+    if a is None or b is None:
+        return b if a is None else a
+    if type(a) is list and type(b) is list:
+        return a + b
+    return (len(a) if type(a) is list else a) + (len(b) if type(b) is list else b)
+
+
+def _pt_float_extend(dst, values):
+    """
+    Append rounded values to list or array('d') scores storage
+    """
+    if type(dst) is array.array:
+        dst.extend(pt_float_many(values))
+    else:
+        dst.extend(map(pt_float, values))
+
+
 def get_timestamp_from_datetime(time):
     assert isinstance(time, datetime.datetime)
     time = time.replace(tzinfo=tzlocal())
@@ -70,15 +192,101 @@ class ptRuntimeException(Exception):
     pass
 
 
+class _ptNoLock:
+    """
+    Lock of the tests which are not added to a suite yet, see ptSuite._addTest()
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_PT_NO_LOCK = _ptNoLock()
+
+
+_tzlocal = tzlocal()
+_json_fields = {}  # class -> (all attributes, public attributes), see _pt_to_dict()
+
+
+def _pt_to_dict(obj):
+    """
+    Returns OrderedDict of the obj public attributes which are not empty. The attributes list is collected
+    once per class and reused while the object has the same set of attributes as the previous one
+    """
+    d = obj.__dict__
+    keys = tuple(d)
+    fields = _json_fields.get(obj.__class__, None)
+    if fields is None or fields[0] != keys:
+        fields = (keys, tuple([k for k in keys if not k.startswith("_")]))
+        _json_fields[obj.__class__] = fields
+
+    j = OrderedDict()
+    for key in fields[1]:
+        val = d[key]
+        if not val:
+            continue
+        if _PY2 and type(val) is str:
+            val = val.decode(errors='ignore').encode('utf-8')
+        j[key] = val
+    return j
+
+
+def _pt_from_dict(obj, j, converters):
+    """
+    Sets the obj attributes from the json dict, converters is {attribute: function(json value)}.
+    Unknown and private attributes are skipped
+    """
+    d = obj.__dict__
+    for key, val in j.items():
+        if key not in d or key.startswith("_"):
+            logging.debug("skipping unrecognized element: %s = %s, while obj is %s" % (key, val, type(obj).__name__))
+            continue
+        conv = converters.get(key, None)
+        d[key] = val if conv is None or val is None else conv(val)
+    return obj
+
+
+def _pt_json_datetime(val):
+    """
+    Converts the ptJsonEncoder isoformat() string back to naive local datetime
+    """
+    try:
+        dt = datetime.datetime.fromisoformat(val)
+    except (AttributeError, ValueError):  # python < 3.7 or not an isoformat() string
+        dt = parser.parse(val)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(_tzlocal).replace(tzinfo=None)
+    return dt
+
+
+def _pt_json_dict(val):
+    if isinstance(val, dict):
+        return val
+    return dict(ast.literal_eval(val))  # repr() of a dict stored by older clients
+
+
 class ptJsonEncoder(json.JSONEncoder):
     def default(self, obj):
-        j = OrderedDict()
-        if not inspect.isclass(type(obj)):
-            return json.dumps(obj)
         if isinstance(obj, datetime.datetime):
-            return obj.replace(tzinfo=tzlocal()).isoformat()
+            return obj.replace(tzinfo=_tzlocal).isoformat()
         if isinstance(obj, uuid.UUID):
             return str(obj)
+        to_dict = getattr(obj, 'to_dict', None)
+        if to_dict is not None:
+            return to_dict()
+        return self.reflect(obj)
+
+    @staticmethod
+    def reflect(obj):
+        """
+        Generic serializer of the objects which don't have the to_dict() method
+        """
+        j = OrderedDict()
+        if not inspect.isclass(type(obj)):
+            return json.dumps(obj)
 
         for key in obj.__dict__.keys():
             if key.startswith("_"):
@@ -86,7 +294,7 @@ class ptJsonEncoder(json.JSONEncoder):
             val = obj.__dict__[key]
             if val is None or not val:
                 continue
-            if type(val) == str:
+            if type(val) is str:
                 try:
                     val = val.decode(errors='ignore').encode('utf-8')
                 except AttributeError as e:
@@ -94,19 +302,120 @@ class ptJsonEncoder(json.JSONEncoder):
             j[key] = val
         return j
 
+    @staticmethod
+    def dumps(obj, pretty=False):
+        """
+        json.dumps() replacement, uses orjson if it is installed (the output is compact then: no spaces
+        after separators), the pretty output is always produced by the json module
+        """
+        if pretty:
+            return json.dumps(obj, cls=ptJsonEncoder, indent=4, separators=(',', ': '))
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=_orjson_default,
+                                    option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+            except TypeError:
+                pass  # i.e. integers larger than 64 bit
+        return json.dumps(obj, cls=ptJsonEncoder)
+
     @staticmethod
     def pretty(obj):
         return json.dumps(obj, cls=ptJsonEncoder, sort_keys=True, indent=4, separators=(',', ': '))
 
 
+_orjson_default = ptJsonEncoder().default
+
+
+class ptSpooledResponse:
+    """
+    Response to a request which is spooled instead of being sent (see ptServer spool_dir), it has the status
+    202 Accepted and spooled=True. The real responses have spooled=False
+    """
+
+    status_code = httplib.ACCEPTED
+    spooled = True
+    retries = 0
+    latency_sec = 0.0
+    content = b''
+
+    def __init__(self, filename):
+        self.filename = filename  # the spool entry
+        self.json = {'message': "spooled to %s" % filename}
+        self.text = json.dumps(self.json)
+
+
+class _ptHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which counts the connections opened by its pools, so we can see
+    how many requests reused a kept-alive connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.connections_opened = 0
+        self.requests_sent = 0
+        HTTPAdapter.__init__(self, *args, **kwargs)
+
+    def _pools_connections(self):
+        pools = self.poolmanager.pools
+        return sum([pools[key].num_connections for key in pools.keys()])
+
+    def send(self, request, *args, **kwargs):
+        before = self._pools_connections()
+        try:
+            return HTTPAdapter.send(self, request, *args, **kwargs)
+        finally:
+            self.requests_sent += 1
+            self.connections_opened += max(0, self._pools_connections() - before)
+
+
 class ptServer:
-    def __init__(self, pt_server_url=None):
+    def __init__(self, pt_server_url=None, pool_connections=1, pool_maxsize=4, keep_alive=True,
+                 retries=5, backoff_sec=0.5, backoff_max_sec=30.0, retry_budget_sec=300.0, timeout_sec=120.0,
+                 compression=None, compression_threshold=1024, spool_dir=None, spool_max_mb=256):
+        """
+        pt_server_url    - perftracker portal url: 'http://perftracker.localdomain:9000'
+        pool_connections - number of per-host connection pools to cache (usually there is just one host)
+        pool_maxsize     - max number of connections kept open to every host
+        keep_alive       - set to False to close the connection after every request
+        retries          - max number of retries of a failed idempotent request (0 - no retries)
+        backoff_sec      - initial retry delay, doubled on every retry and randomized (full jitter)
+        backoff_max_sec  - max retry delay, it also limits the 'Retry-After' delay requested by the server
+        retry_budget_sec - max time a request is allowed to spend waiting for its retries
+        timeout_sec      - default connect and read timeout of the requests, so a hung connection is retried
+        compression      - compress post() bodies larger than compression_threshold bytes: None, 'gzip' or 'zstd'
+        spool_dir        - directory to spool the job and artifact posts to if the server is unavailable,
+                           the spool is replayed before the next post, or by tools/pt-spool-flush.py
+        spool_max_mb     - max spool size, the oldest requests are evicted when it is exceeded
+        """
         if pt_server_url is None:
             pt_server_url = PT_SERVER_DEFAULT_URL
         self.url = None
         self.api_url = None
         self.setUrl(pt_server_url)
 
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._keep_alive = keep_alive
+        self._session = None
+        self._adapters = []
+
+        self._retries = retries
+        self._backoff_sec = backoff_sec
+        self._backoff_max_sec = backoff_max_sec
+        self._retry_budget_sec = retry_budget_sec
+        self._timeout_sec = timeout_sec
+        self._retries_done = 0
+        self._retry_wait_sec = 0.0
+        self._latency_sec = 0.0
+
+        self._compression = None
+        self._compression_threshold = compression_threshold
+        self.setCompression(compression)
+
+        self._spool = None
+        if spool_dir:
+            self.setSpool(spool_dir, spool_max_mb)
+
     def setUrl(self, pt_server_url):
         if not pt_server_url.startswith("http"):
             logging.debug("adding http:// prefix to server url: %s" % pt_server_url)
@@ -114,6 +423,174 @@ class ptServer:
         self.url = pt_server_url.rstrip("/")
         self.api_url = "%s/api/v%s" % (self.url, API_VER)
 
+    def to_dict(self):
+        return _pt_to_dict(self)
+
+    def setCompression(self, codec, threshold=None):
+        if codec not in (None, ) + COMPRESSION_CODECS:
+            raise ptRuntimeException("unsupported compression '%s', must be one of: %s" %
+                                     (codec, ", ".join(COMPRESSION_CODECS)))
+        if codec == 'zstd' and zstandard is None:
+            logging.warning("zstandard module is not installed, falling back to gzip compression")
+            codec = 'gzip'
+        self._compression = codec
+        if threshold is not None:
+            self._compression_threshold = threshold
+
+    def setSpool(self, spool_dir, max_mb=256):
+        self._spool = Spool(spool_dir, max_bytes=max_mb * 1024 * 1024) if spool_dir else None
+
+    @property
+    def spool(self):
+        return self._spool
+
+    def _spoolRequest(self, method, path, headers, kwargs, key=None, replace=False):
+        url = "%s/%s" % (self.api_url, path.lstrip("/"))
+        data = kwargs.get('data', None)
+        req = requests.Request(method.upper(), url, headers=headers, data=data() if callable(data) else data,
+                               files=kwargs.get('files', None)).prepare()
+        meta = {'method': method, 'path': path, 'key': key,
+                'headers': dict([(k, v) for k, v in req.headers.items()
+                                 if k.lower() not in ('content-length', 'transfer-encoding')])}
+        name = self._spool.put(meta, req.body if req.body else b'', replaces=key if replace else None)
+        filename = os.path.join(self._spool.dirname, name)
+        logging.warning("%s %s ... is spooled to %s" % (method, url, filename))
+        return ptSpooledResponse(filename)
+
+    def flushSpool(self):
+        """
+        Replay the spooled requests in order, returns True if the spool is empty
+        """
+        if self._spool is None:
+            return True
+
+        def _send(meta, body):
+            url = "%s/%s" % (self.api_url, meta['path'].lstrip("/"))
+            try:
+                response, _ = self._sendWithRetries(meta['method'], url, True, data=body, headers=meta['headers'])
+            except ptRuntimeException as e:
+                logging.warning("%s %s ... spool replay failed: %s" % (meta['method'], url, str(e)))
+                return False
+            if response.status_code == httplib.OK:
+                return True
+            if response.status_code >= 500 or response.status_code in RETRY_HTTP_STATUSES:
+                logging.warning("%s %s ... spool replay failed, status %d" %
+                                (meta['method'], url, response.status_code))
+                return False
+            logging.error("%s %s ... status %d: %s" % (meta['method'], url, response.status_code, response.text))
+            return None
+
+        replayed = self._spool.replay(_send)
+        left = len(self._spool)
+        if replayed or left:
+            logging.info("%d spooled requests replayed, %d left in %s" % (replayed, left, self._spool.dirname))
+        return left == 0
+
+    def _compressor(self):
+        if self._compression == 'zstd':
+            return zstandard.ZstdCompressor().compressobj()
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def _compress(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        c = self._compressor()
+        return c.compress(data) + c.flush()
+
+    def _compressIter(self, chunks):
+        c = self._compressor()
+        for chunk in chunks:
+            data = c.compress(chunk)
+            if data:
+                yield data
+        yield c.flush()
+
+    @property
+    def session(self):
+        """
+        The requests.Session() owned by the server, all the ptSuite/ptArtifact requests go through it
+        """
+        if self._session is None:
+            self._session = requests.Session()
+            for prefix in ("http://", "https://"):
+                adapter = _ptHTTPAdapter(pool_connections=self._pool_connections, pool_maxsize=self._pool_maxsize)
+                self._session.mount(prefix, adapter)
+                self._adapters.append(adapter)
+            if not self._keep_alive:
+                self._session.headers['Connection'] = 'close'
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def getStats(self):
+        """
+        Returns the connections and retries counters:
+            {'requests': 10, 'connections_opened': 1, 'connections_reused': 9,
+             'retries': 1, 'retry_wait_sec': 0.7, 'latency_sec': 1.2}
+        latency_sec is the total wall time spent in requests (including the retries)
+        """
+        stats = OrderedDict()
+        stats['requests'] = sum([a.requests_sent for a in self._adapters])
+        stats['connections_opened'] = sum([a.connections_opened for a in self._adapters])
+        stats['connections_reused'] = max(0, stats['requests'] - stats['connections_opened'])
+        stats['retries'] = self._retries_done
+        stats['retry_wait_sec'] = round(self._retry_wait_sec, 3)
+        stats['latency_sec'] = round(self._latency_sec, 3)
+        return stats
+
+    def _getRetryDelay(self, attempt, response=None):
+        if response is not None and response.headers.get('Retry-After'):
+            retry_after = response.headers['Retry-After'].strip()
+            if retry_after.isdigit():
+                return min(float(retry_after), self._backoff_max_sec)
+            date = email.utils.parsedate_tz(retry_after)
+            if date:
+                return min(max(0.0, email.utils.mktime_tz(date) - time.time()), self._backoff_max_sec)
+        return random.uniform(0, min(self._backoff_max_sec, self._backoff_sec * (2 ** attempt)))
+
+    def _sendWithRetries(self, method, url, idempotent, *args, **kwargs):
+        kwargs.setdefault('timeout', self._timeout_sec)
+        attempt = 0
+        wait_sec = 0.0
+        while True:
+            response = None
+            error = None
+            attempt_kwargs = kwargs
+            if callable(kwargs.get('data', None)):
+                # streamed body, every attempt needs a new chunks generator
+                attempt_kwargs = dict(kwargs, data=kwargs['data']())
+            try:
+                response = self.session.request(method, url, *args, **attempt_kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = str(e)
+
+            if response is not None and response.status_code not in RETRY_HTTP_STATUSES:
+                return response, attempt
+            if not idempotent or attempt >= self._retries:
+                break
+
+            delay = self._getRetryDelay(attempt, response)
+            if wait_sec + delay > self._retry_budget_sec:
+                logging.warning("%s %s ... retry budget (%.1f sec) is exhausted" %
+                                (method, url, self._retry_budget_sec))
+                break
+
+            logging.warning("%s %s ... %s, retry %d/%d in %.1f sec" %
+                            (method, url, error if error else "status %d" % response.status_code,
+                             attempt + 1, self._retries, delay))
+            time.sleep(delay)
+            wait_sec += delay
+            self._retry_wait_sec += delay
+            self._retries_done += 1
+            attempt += 1
+
+        if error:
+            raise ptRuntimeException(error)
+        return response, attempt
+
     def getProjectId(self, project_name):
         if not project_name:
             return None
@@ -133,17 +610,48 @@ class ptServer:
         raise ptRuntimeException(msg)
 
     def _http_request(self, method, url, decode_json=True, *args, **kwargs):
+        """
+        Pass idempotent=True to retry non-idempotent methods (POST), the retry must be safe then (i.e. keyed by uuid)
+        Pass spool=True to spool the request if the server is unavailable (see spool_dir), ptSpooledResponse
+        is returned then.
+        spool_key identifies the spooled object, spool_replace=True drops the older spooled requests with the key
+        """
 
+        path = url
         url = "%s/%s" % (self.api_url, url.lstrip("/"))
+        idempotent = kwargs.pop('idempotent', method in IDEMPOTENT_HTTP_METHODS)
+        spool = kwargs.pop('spool', False) and self._spool is not None
+        spool_key = kwargs.pop('spool_key', None)
+        spool_replace = kwargs.pop('spool_replace', False)
 
         logging.debug("%s %s ..." % (method, url))
 
-        # FIXME: handle retry
         headers = {'Content-Type': 'application/json'} if method == "GET" else {}
+        headers.update(kwargs.pop('headers', {}))
+
+        if spool and len(self._spool) and not self.flushSpool():
+            # the server is still unavailable, keep the requests order
+            return self._spoolRequest(method, path, headers, kwargs, spool_key, spool_replace)
+
+        begin = time.time()
         try:
-            response = requests.__dict__[method](url, headers=headers, *args, **kwargs)
-        except requests.exceptions.ConnectionError as e:
-            raise ptRuntimeException(str(e))
+            response, retries = self._sendWithRetries(method, url, idempotent, headers=headers, *args, **kwargs)
+        except ptRuntimeException as e:
+            if not spool:
+                raise
+            logging.warning("%s %s ... %s" % (method, url, str(e)))
+            return self._spoolRequest(method, path, headers, kwargs, spool_key, spool_replace)
+        finally:
+            self._latency_sec += time.time() - begin
+
+        if spool and (response.status_code >= 500 or response.status_code in RETRY_HTTP_STATUSES):
+            logging.warning("%s %s ... status %d" % (method, url, response.status_code))
+            return self._spoolRequest(method, path, headers, kwargs, spool_key, spool_replace)
+        response.spooled = False
+        response.latency_sec = time.time() - begin
+        response.retries = retries
+        logging.debug("%s %s ... status %d, %.3f sec, %d retries" %
+                      (method, url, response.status_code, response.latency_sec, retries))
 
         if decode_json or response.status_code != httplib.OK:
             text = response.text.encode(response.encoding if response.encoding else 'utf-8', 'strict')
@@ -167,6 +675,20 @@ class ptServer:
         return response
 
     def post(self, url, decode_json=True, *args, **kwargs):
+        """
+        data can be a callable returning a generator of bytes chunks, the body is sent with the chunked
+        transfer encoding then (the callable is called again on every retry)
+        """
+        data = kwargs.get('data', None)
+        if self._compression and callable(data):
+            # the streamed body size is unknown, so it is always compressed
+            kwargs['data'] = lambda: self._compressIter(data())
+            kwargs['headers'] = dict(kwargs.get('headers', {}), **{'Content-Encoding': self._compression})
+        elif self._compression and isinstance(data, (str, bytes)) and len(data) >= self._compression_threshold:
+            kwargs['data'] = self._compress(data)
+            kwargs['headers'] = dict(kwargs.get('headers', {}), **{'Content-Encoding': self._compression})
+            logging.debug("post %s ... %s compressed body: %d -> %d bytes" %
+                          (url, self._compression, len(data), len(kwargs['data'])))
         return self._http_request('post', url, decode_json=decode_json, *args, **kwargs)
 
     def get(self, url, decode_json=True, *args, **kwargs):
@@ -209,6 +731,13 @@ class ptArtifact:
     def validate(self):
         assert self._pt_server is not None
 
+    def to_dict(self):
+        j = _pt_to_dict(self)
+        for key in ('linked_uuids', 'unlinked_uuids'):
+            if key in j:
+                j[key] = sorted(j[key])
+        return j
+
     def delete(self):
         return self._pt_server.delete(self._url)
 
@@ -220,7 +749,7 @@ class ptArtifact:
         uuids = [str(u) for u in uuids]
         self.linked_uuids |= set(uuids)
         data = {'linked_uuids': json.dumps(list(self.linked_uuids))}
-        return self._pt_server.post(self._url, data=data)
+        return self._pt_server.post(self._url, data=data, idempotent=True, spool=True)
 
     def unlink(self, uuids):
         assert type(uuids) is list
@@ -228,7 +757,7 @@ class ptArtifact:
         self.linked_uuids |= set(uuids)
         self.unlinked_uuids -= set(uuids)
         data = {'unlinked_uuids': json.dumps(list(self.unlinked_uuids))}
-        return self._pt_server.post(self._url, data=data)
+        return self._pt_server.post(self._url, data=data, idempotent=True, spool=True)
 
     def update(self):
         assert self.uuid is not None
@@ -240,7 +769,7 @@ class ptArtifact:
                 'unlinked_uuids': json.dumps(list(self.unlinked_uuids))
                 }
 
-        return self._pt_server.post(self._url, data=data)
+        return self._pt_server.post(self._url, data=data, idempotent=True, spool=True)
 
     def upload(self, filepath):
         assert self.uuid is not None
@@ -264,7 +793,7 @@ class ptArtifact:
                 'unlinked_uuids': json.dumps(list(self.unlinked_uuids))
                 }
 
-        return self._pt_server.post(self._url, files=files, data=data)
+        return self._pt_server.post(self._url, files=files, data=data, idempotent=True, spool=True)
 
     def list(self, limit=10, offset=0):
         resp = self._pt_server.get(self._url_list)
@@ -305,7 +834,8 @@ class ptTest:
     def __init__(self, tag=None, uuid1=None, group=None, binary=None, cmdline=None, description=None,
                  loops=None, scores=None, deviations=None, category=None, metrics="loops/sec",
                  links=None, attribs=None, less_better=False, errors=None, warnings=None,
-                 begin=None, end=None, duration_sec=0, status='SUCCESS', validate=True):
+                 begin=None, end=None, duration_sec=0, status='SUCCESS', compact=False, summary=False,
+                 validate=True):
         """
         tag         - keyword used to match tests results in different suites: hdd sequential read
         group       - test group: memory, disk, cpu, ...)
@@ -329,6 +859,12 @@ class ptTest:
         end         - time when the test ended in datetime.datetime format
         duration_sec - test duration (sec)
         status      - test status: PASS, FAIL, SKIPPED, INPROGRESS, NOTSTARTED
+        compact     - keep scores and deviations in array('d') (8 bytes per value instead of ~32 in a list),
+                      use it for the tests with millions of samples
+        summary     - don't keep the scores, collect their streaming summary (QuantileSketch) instead, so memory
+                      doesn't grow with the number of samples (i.e. per-request latencies). The test is
+                      uploaded with scores=[mean], deviations=[stddev] and the p50, p90, p99, p99.9 and samples
+                      count in attribs
         """
 
         self.seq_num = None
@@ -338,9 +874,15 @@ class ptTest:
         self.binary = binary
         self.cmdline = cmdline
         self.description = description
-        self.scores = [pt_float(s) for s in scores] if scores else []
+        self.scores = array.array('d') if compact else []
         self.loops = loops
-        self.deviations = [pt_float(d) for d in deviations] if deviations else []
+        self.deviations = array.array('d') if compact else []
+        self._sketch = QuantileSketch() if summary else None
+        self._lock = _PT_NO_LOCK  # the suite lock once the test is added to a suite
+        if scores:
+            self.add_scores(scores)
+        if deviations:
+            _pt_float_extend(self.deviations, deviations)
         self.category = category
         self.metrics = metrics
         self.links = links if links else {}
@@ -355,10 +897,58 @@ class ptTest:
 
         self._auto_end = end
         self._auto_begin = begin
+        self._dirty = True  # changed since the last upload
 
         if validate:
             self.validate()
 
+    def to_dict(self):
+        j = _pt_to_dict(self)
+        for key in ('scores', 'deviations'):
+            if type(j.get(key, None)) is array.array:
+                j[key] = j[key].tolist()
+        if self._sketch is not None and self._sketch.count:
+            j['scores'] = [pt_float(self._sketch.mean)]
+            j['deviations'] = [pt_float(self._sketch.stddev)]
+            attribs = dict(self.attribs)
+            for key, val in self._sketch.summary().items():
+                if key == "samples":
+                    attribs[key] = val
+                elif key.startswith("p"):
+                    attribs[key] = pt_float(val)
+            j['attribs'] = attribs
+        return j
+
+    @staticmethod
+    def from_dict(j):
+        return _pt_from_dict(ptTest(j.get('tag', None), validate=False), j, _ptTestJsonConverters)
+
+    def _toResults(self):
+        """
+        Same as to_dict(), but keeps the raw scores and the sketch state, see ptSuite.dumpResults()
+        """
+        j = _pt_to_dict(self)
+        if type(self.scores) is array.array:
+            j['compact'] = True
+            for key in ('scores', 'deviations'):
+                if key in j:
+                    j[key] = j[key].tolist()
+        if self._sketch is not None:
+            j['sketch'] = self._sketch.to_dict()
+        return j
+
+    @staticmethod
+    def _fromResults(j):
+        j = dict(j)
+        sketch = j.pop('sketch', None)
+        test = ptTest(j.get('tag', None), compact=j.pop('compact', False), validate=False)
+        for key in ('scores', 'deviations'):
+            getattr(test, key).extend(j.pop(key, []))  # already rounded
+        _pt_from_dict(test, j, _ptTestJsonConverters)
+        if sketch is not None:
+            test._sketch = QuantileSketch.from_dict(sketch)
+        return test
+
     def __eq__(self, other):
         assert isinstance(other, ptTest)
         attributes = ["tag", "group", "category", "metrics", "less_better"]
@@ -371,9 +961,9 @@ class ptTest:
         assert self.attribs is None or type(self.attribs) is dict
         assert self.errors is None or type(self.errors) is int or type(self.errors) is list
         assert self.warnings is None or type(self.warnings) is int or type(self.warnings) is list
-        assert self.scores is None or type(self.scores) is list
+        assert self.scores is None or type(self.scores) in (list, array.array)
         assert self.loops is None or type(self.loops) is int
-        assert self.deviations is None or type(self.deviations) is list
+        assert self.deviations is None or type(self.deviations) in (list, array.array)
         assert (self.deviations is None) or len(self.deviations) == 0 or \
                (self.scores is not None and len(self.scores) == len(self.deviations))
         assert self.begin is None or type(self.begin) is datetime.datetime
@@ -424,14 +1014,89 @@ class ptTest:
         return status, out, err
 
     def add_score(self, score):
-        if isinstance(score, list):
-            for s in score:
-                self.scores.append(pt_float(s))
-        else:
-            self.scores.append(pt_float(score))
+        if isinstance(score, (list, tuple, array.array)):
+            return self.add_scores(score)
+        with self._lock:
+            if self._sketch is not None:
+                self._sketch.add(score)
+            else:
+                self.scores.append(pt_float(score))
+            self._dirty = True
+
+    def add_scores(self, scores):
+        """
+        Bulk append of an iterable of scores
+        """
+        with self._lock:
+            if self._sketch is not None:
+                self._sketch.add_many(scores)
+            else:
+                _pt_float_extend(self.scores, scores)
+            self._dirty = True
 
     def add_deviation(self, dev):
-        self.scores.append(pt_float(dev))
+        if isinstance(dev, (list, tuple, array.array)):
+            self.add_deviations(dev)
+        else:
+            self.add_deviations([dev])
+
+    def add_deviations(self, deviations):
+        if self._sketch is not None:
+            raise ptRuntimeException("deviations of the summary test '%s' are calculated from the scores" %
+                                     self.tag)
+        with self._lock:
+            _pt_float_extend(self.deviations, deviations)
+            self._dirty = True
+
+    @property
+    def sketch(self):
+        """
+        QuantileSketch of the scores if the test is created with summary=True, None otherwise
+        """
+        return self._sketch
+
+    def merge(self, other):
+        """
+        Add the other run of the same test (i.e. by another worker) to this test: the scores are appended,
+        loops, errors, warnings and duration_sec are summed up, begin and end cover both runs, the status
+        is the worst one (FAILED, INPROGRESS, SUCCESS, SKIPPED, NOTTESTED)
+        """
+        assert isinstance(other, ptTest)
+        with self._lock:
+            self.loops = _pt_merge_counters(self.loops, other.loops)
+            self.errors = _pt_merge_counters(self.errors, other.errors)
+            self.warnings = _pt_merge_counters(self.warnings, other.warnings)
+            self.duration_sec += other.duration_sec
+            self.begin = min(self.begin, other.begin)
+            self.end = max(self.end, other.end)
+            if _TEST_STATUS_MERGE_PRIORITY[other.status] > _TEST_STATUS_MERGE_PRIORITY[self.status]:
+                self.status = other.status
+
+            if self._sketch is None and other._sketch is not None:
+                # switch to the summary, the other test doesn't have the raw scores
+                self._sketch = QuantileSketch(other._sketch.accuracy)
+                self._sketch.add_many(self.scores)
+                del self.scores[:]
+                del self.deviations[:]
+
+            if self._sketch is None:
+                if len(self.deviations) or len(other.deviations):
+                    # keep a deviation per score, the runs without deviations get zero ones
+                    if not len(self.deviations):
+                        self.add_deviations([0.0] * len(self.scores))
+                    self.add_deviations(other.deviations if len(other.deviations) else [0.0] * len(other.scores))
+                self.add_scores(other.scores)
+            elif other._sketch is not None:
+                self._sketch.merge(other._sketch)
+            else:
+                self._sketch.add_many(other.scores)
+            self._dirty = True
+
+    def mark_dirty(self):
+        """
+        Call it after changing the test attributes directly, so that the delta upload sends the test again
+        """
+        self._dirty = True
 
     def add_artifact(self, artifact):
         assert isinstance(artifact, ptArtifact)
@@ -498,6 +1163,25 @@ class ptEnvNode:
         assert self.disk_gb is None or type(self.disk_gb) is int
         assert self.links is None or type(self.links) is dict
 
+    def to_dict(self):
+        return _pt_to_dict(self)
+
+    @staticmethod
+    def from_dict(j):
+        """
+        Creates ptHost, ptComponent, ptVM or ptEnvNode depending on the node_type
+        """
+        node_type = j.get('node_type', None)
+        if node_type == "Host":
+            node = ptHost(validate=False)
+        elif node_type == "service":
+            node = ptComponent(validate=False)
+        elif node_type:
+            node = ptVM(virt_type=node_type, validate=False)
+        else:
+            node = ptEnvNode(validate=False)
+        return _pt_from_dict(node, j, _ptEnvNodeJsonConverters)
+
     def addNode(self, node):
         assert isinstance(node, ptEnvNode)
         self.children.append(node)
@@ -543,13 +1227,129 @@ class ptProduct:
         self.name = name
         self.version = str(version)
 
+    def to_dict(self):
+        return _pt_to_dict(self)
+
+
+_ptTestJsonConverters = {
+    'uuid': uuid.UUID,
+    'begin': _pt_json_datetime,
+    'end': _pt_json_datetime,
+    'links': _pt_json_dict,
+    'attribs': _pt_json_dict,
+    'duration_sec': int,
+}
+
+_ptEnvNodeJsonConverters = {
+    'uuid': uuid.UUID,
+    'links': _pt_json_dict,
+    'children': lambda val: [ptEnvNode.from_dict(j) for j in val],
+}
+
+
+_pt_async_uploaders = []  # the started uploaders, stopped at exit
+
+
+def _pt_stop_async_uploaders():
+    for uploader in list(_pt_async_uploaders):
+        uploader.stop()
+
+
+atexit.register(_pt_stop_async_uploaders)
+
+
+class ptAsyncUploader:
+    """
+    Calls upload_cb() from a background thread, so the caller doesn't wait for the portal.
+    Uploads are coalesced: if several uploads are scheduled while the previous one is in progress,
+    upload_cb() is called just once more, so only the latest snapshot is sent
+    """
+
+    def __init__(self, upload_cb, timeout_sec=60):
+        self._upload_cb = upload_cb
+        self._timeout_sec = timeout_sec
+        self._cond = threading.Condition()
+        self._pending = False
+        self._busy = False
+        self._stopped = False
+        self._thread = None
+
+        self.uploads = 0
+        self.coalesced = 0
+        self.error = None
+
+    def schedule(self):
+        with self._cond:
+            if self._stopped:
+                raise ptRuntimeException("the uploader is stopped")
+            if self._pending:
+                self.coalesced += 1
+            self._pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ptAsyncUploader")
+                self._thread.daemon = True
+                self._thread.start()
+                _pt_async_uploaders.append(self)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                self._pending = False
+                self._busy = True
+
+            try:
+                self._upload_cb()
+                self.error = None
+            except Exception as e:
+                logging.error("background upload failed: %s" % str(e))
+                self.error = e
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self.uploads += 1
+                    self._cond.notify_all()
+
+    def flush(self, timeout_sec=None):
+        """
+        Wait for the scheduled uploads, returns False on timeout or if the last upload has failed
+        """
+        if timeout_sec is None:
+            timeout_sec = self._timeout_sec
+        deadline = time.time() + timeout_sec
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logging.error("background upload is not finished in %.1f sec" % timeout_sec)
+                    return False
+                self._cond.wait(remaining)
+        return self.error is None
+
+    def stop(self, timeout_sec=None):
+        if self._thread is None:
+            return True
+        ret = self.flush(timeout_sec)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self in _pt_async_uploaders:
+            _pt_async_uploaders.remove(self)
+        return ret
+
 
 class ptSuite:
     def __init__(self, job_title='job title', project_name=None, cmdline=None,
                  product_name=None, product_ver=None, regression_name=None,
                  suite_name=None, suite_ver=None,
                  uuid1=None, append=False, replace=False, begin=None, end=None, links=None,
-                 pt_server_url=PT_SERVER_DEFAULT_URL, save_to_file=None):
+                 pt_server_url=PT_SERVER_DEFAULT_URL, save_to_file=None, pt_server=None,
+                 async_upload=False, upload_timeout_sec=60, delta_upload=False, spool_dir=None,
+                 stream_upload=False):
         """
         job_name   - job title on portal: '[disk tests] KVM 2.6.32'
         suite_name - suite name to filter/search: 'disk tests'
@@ -557,6 +1357,13 @@ class ptSuite:
         append     - set to True to append data to existing job data with given uuid
         begin      - time when job started (must have the datetime.datetime type)
         end        - time when job ended (must have the datetime.datetime type)
+        pt_server  - existing ptServer instance to share its connections pool (overrides pt_server_url)
+        async_upload - upload() from a background thread, fini() waits upload_timeout_sec for pending uploads
+        delta_upload - after the first upload send only the tests changed since the previous one (appending
+                       them to the job), any failure makes the next upload a full one
+        spool_dir  - directory to spool the uploads to if the portal is unavailable, see ptServer()
+        stream_upload - send the job json with the chunked transfer encoding as it is serialized, instead of
+                        building it in memory (the portal web server must support chunked requests)
         """
 
         self._seq_num = 0
@@ -586,7 +1393,10 @@ class ptSuite:
         self.tests = []
         self._key2test = {}
 
-        self.pt_server = ptServer(pt_server_url)
+        self.pt_server = pt_server if pt_server else ptServer(pt_server_url)
+        self._own_pt_server = pt_server is None
+        if spool_dir:
+            self.pt_server.setSpool(spool_dir)
         self._save_to_file = save_to_file
         self._pt_options_added = False
 
@@ -595,6 +1405,17 @@ class ptSuite:
         self._stdout_artifact = None
         self._stderr_artifact = None
 
+        # protects tests & nodes lists from changes while the background uploader serializes them
+        self._lock = threading.RLock()
+        self._upload_timeout_sec = upload_timeout_sec
+        self._async_uploader = None
+        if async_upload:
+            self.setAsyncUpload(True)
+
+        self._delta_upload = delta_upload
+        self._delta_synced = False  # True if the portal has all the tests except the dirty ones
+        self._stream_upload = stream_upload
+
         self.validate()
 
     def validate(self):
@@ -602,9 +1423,13 @@ class ptSuite:
         assert type(self.end) is datetime.datetime
         assert self.links is None or type(self.links) is dict
 
+    def to_dict(self):
+        return _pt_to_dict(self)
+
     def addNode(self, node):
         assert isinstance(node, ptEnvNode)
-        self.env_nodes.append(node)
+        with self._lock:
+            self.env_nodes.append(node)
         return node
 
     def addLink(self, name, url):
@@ -612,7 +1437,8 @@ class ptSuite:
         name    - link name: 'monitoring dashboard'
         url     - link url:  'http://grafana.localdomain/host1'
         """
-        self.links[str(name)] = str(url)
+        with self._lock:
+            self.links[str(name)] = str(url)
 
     def addGrafanaLink(self, grafana_url):
         """
@@ -630,78 +1456,190 @@ class ptSuite:
 
     def addTest(self, test):
         assert isinstance(test, ptTest)
+        with self._lock:
+            self._addTest(test)
+
+    def _addTest(self, test):
         if not self.append:
             self._seq_num += 1
             test.seq_num = self._seq_num
         added_test = self.getTest(tag=test.tag, group=test.group, category=test.category)
         if added_test is None:
+            test._lock = self._lock  # the test changes must not interleave with its serialization
             self.tests.append(test)
-            key = "%s-%s-%s" % (test.tag, str(test.group), str(test.category))
-            self._key2test[key] = test
+            self._key2test[self._testKey(test.tag, test.group, test.category)] = test
         elif added_test == test:
-            # TODO add_deviations
-            added_test.add_score(test.scores)
+            added_test.merge(test)
         else:
             raise ptRuntimeException("ptTest with received tag, group, category already exists, but other "
                                      "attributes differs")
 
+    def dumpResults(self, tests=None):
+        """
+        Serialize the tests results (all or given ones) to be merged by mergeResults() into another suite,
+        i.e. send them from a worker process or host to the coordinator which uploads the job.
+        The format is zlib-compressed json (no pickle), raw scores and summary sketches are kept as is
+        """
+        with self._lock:
+            j = {'version': RESULTS_FORMAT_VERSION,
+                 'tests': [t._toResults() for t in (self.tests if tests is None else tests)]}
+            data = ptJsonEncoder.dumps(j)
+        return zlib.compress(data.encode('utf-8'))
+
+    def mergeResults(self, data):
+        """
+        Add the tests results serialized by dumpResults(), the tests which are already in the suite are merged
+        with ptTest.merge(). Returns the number of merged tests
+        """
+        try:
+            j = json.loads(zlib.decompress(data).decode('utf-8'))
+        except (zlib.error, ValueError) as e:
+            raise ptRuntimeException("can't parse the tests results: %s" % str(e))
+        if j.get('version', None) != RESULTS_FORMAT_VERSION:
+            raise ptRuntimeException("unsupported tests results version: %s, expected: %d" %
+                                     (str(j.get('version', None)), RESULTS_FORMAT_VERSION))
+
+        tests = [ptTest._fromResults(t) for t in j['tests']]
+        with self._lock:
+            for t in tests:
+                self._addTest(t)
+        return len(tests)
+
     def addArtifact(self, uuid1=None):
         return ptArtifact(pt_server=self.pt_server, uuid1=uuid1)
 
-    def initFromJson(self, json_obj):
-        logging.debug("initializing data from json: %s" % str(json_obj))
+    def initFromJson(self, json_obj, replace=False):
+        """
+        Load the job json (i.e. saved by --pt-to-file), the loaded tests and nodes are appended to the existing
+        ones, or replace them if replace is True
+        """
+        converters = {
+            'uuid': uuid.UUID,
+            'begin': _pt_json_datetime,
+            'end': _pt_json_datetime,
+            'links': _pt_json_dict,
+            'env_nodes': lambda val: [ptEnvNode.from_dict(j) for j in val],
+            'tests': lambda val: [ptTest.from_dict(j) for j in val],
+        }
+        j = dict(json_obj)
+        j.pop('pt_server', None)  # keep the server this suite is connected to
+
+        with self._lock:
+            tests, env_nodes = self.tests, self.env_nodes
+            _pt_from_dict(self, j, converters)
+            if not replace:
+                if self.tests is not tests:
+                    self.tests = tests + self.tests
+                if self.env_nodes is not env_nodes:
+                    self.env_nodes = env_nodes + self.env_nodes
+
+            self._key2test = {}
+            for test in self.tests:
+                test._lock = self._lock
+                self._key2test.setdefault(self._testKey(test.tag, test.group, test.category), test)
+            self._seq_num = max([t.seq_num or 0 for t in self.tests] + [0])
+            self._delta_synced = False
 
-        def _initFromJson(obj, json_obj):
-            for el_name in json_obj:
-                if str(el_name) not in obj.__dict__:
-                    logging.debug("skipping unrecognized element: %s = %s, while obj is: %s" %
-                                  (str(el_name), json_obj[el_name], obj.__dict__))
-                    continue
+    @staticmethod
+    def _testKey(tag, group, category):
+        return "%s-%s-%s" % (tag, str(group), str(category))
 
-                member = obj.__dict__[el_name]
-
-                if member is None:
-                    obj.__dict__[el_name] = json_obj[el_name]
-                elif type(member) is list:
-                    if len(member):
-                        for j in json_obj[el_name]:
-                            if hasattr(member[0], 'validate'):
-                                new_obj = member[0].__class__(validate=False)
-                            else:
-                                try:
-                                    new_obj = member[0].__class__()
-                                except TypeError as e:
-                                    logging.error("EXCEPTION: class: %s, error: %s" %
-                                                  (member[0].__class__.__name__, str(e)))
-                                    raise
-                            _initFromJson(new_obj, j)
-                            member.append(new_obj)
-                    else:
-                        obj.__dict__[el_name] = json_obj[el_name]
-                elif obj.__dict__[el_name].__class__.__name__.startswith('pt'):
-                    # special hack to handle ptServer, ptTest, ptArtifact, ...
-                    new_obj = member.__class__()
-                    _initFromJson(new_obj, json_obj[el_name])
-                elif type(member) is datetime.datetime:
-                    obj.__dict__[el_name] = json_obj[el_name]
-                elif type(member) is dict:
-                    try:
-                        obj.__dict__[el_name] = dict(json_obj[el_name])
-                    except ValueError as e:
-                        obj.__dict__[el_name] = ast.literal_eval(json_obj[el_name])
-                else:
-                    obj.__dict__[el_name] = type(member)(json_obj[el_name])
+    def getTest(self, tag, group=None, category=None):
+        return self._key2test.get(self._testKey(tag, group, category), None)
 
-        _initFromJson(self, json_obj)
+    def toJson(self, pretty=False, tests=None):
+        """
+        tests - serialize given tests only, to be appended to the existing job (delta upload)
+        """
+        obj = self
+        if tests is not None:
+            obj = self.to_dict()
+            obj['tests'] = tests
+            obj['append'] = True
+            obj.pop('replace', None)
+        return ptJsonEncoder.dumps(obj, pretty=pretty)
+
+    def iterJson(self, pretty=False, tests=None, chunk_size=64 * 1024):
+        """
+        Returns generator of the toJson() output chunks of about chunk_size length. The tests are serialized one
+        by one, so the whole job json is never kept in memory. The json is generated from the suite snapshot
+        taken by this call, the later suite changes don't affect it
+        """
+        return self._iterJsonSnapshot(self._jsonSnapshot(pretty, tests), pretty, chunk_size)
 
-    def getTest(self, tag, group=None, category=None):
-        key = "%s-%s-%s" % (tag, str(group), str(category))
-        return self._key2test.get(key, None)
+    def _jsonSnapshot(self, pretty=False, tests=None):
+        """
+        Returns [(key, value json), ...] of the job, 'tests' value is the list of the tests dicts which have
+        their own copies of the scores, deviations and other lists and dicts
+        """
+        with self._lock:
+            j = self.to_dict()
+            if tests is not None:
+                j['tests'] = tests
+                j['append'] = True
+                j.pop('replace', None)
+
+            indent = "\n    " if pretty else ""
+            snapshot = []
+            for key, val in j.items():
+                if key == 'tests' and val:
+                    val = [OrderedDict([(k, list(v) if isinstance(v, list) else dict(v) if isinstance(v, dict) else v)
+                                        for k, v in t.to_dict().items()]) for t in val]
+                else:
+                    val = ptJsonEncoder.dumps(val, pretty=pretty).replace("\n", indent)
+                snapshot.append((key, val))
+        return snapshot
 
-    def toJson(self, pretty=False):
+    @staticmethod
+    def _iterJsonSnapshot(snapshot, pretty=False, chunk_size=64 * 1024):
         if pretty:
-            return json.dumps(self, cls=ptJsonEncoder, indent=4, separators=(',', ': '))
-        return json.dumps(self, cls=ptJsonEncoder)
+            begin, sep, end, colon = "{\n    ", ",\n    ", "\n}", ": "
+            tests_begin, tests_sep, tests_end = "[\n        ", ",\n        ", "\n    ]"
+        else:
+            sep, colon = (",", ":") if orjson is not None else (", ", ": ")  # same as ptJsonEncoder.dumps()
+            begin, end = "{", "}"
+            tests_begin, tests_sep, tests_end = "[", sep, "]"
+
+        def _parts():
+            yield begin
+            for n, (key, val) in enumerate(snapshot):
+                if n:
+                    yield sep
+                yield json.dumps(key) + colon
+                if key != 'tests' or not isinstance(val, list):
+                    yield val
+                    continue
+                yield tests_begin
+                for i, t in enumerate(val):
+                    if i:
+                        yield tests_sep
+                    yield ptJsonEncoder.dumps(t, pretty=pretty).replace("\n", tests_sep[1:])
+                yield tests_end
+            yield end
+
+        buf = []
+        size = 0
+        for part in _parts():
+            buf.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield "".join(buf)
+                buf = []
+                size = 0
+        if buf:
+            yield "".join(buf)
+
+    def _saveToFile(self, tests=None):
+        if self._save_to_file == "-":
+            print("Job json:")
+            for chunk in self.iterJson(pretty=True, tests=tests):
+                sys.stdout.write(chunk)
+            print("")
+        else:
+            with open(self._save_to_file, 'w') as f:
+                for chunk in self.iterJson(pretty=True, tests=tests):
+                    f.write(chunk)
+            logging.info("saving json data to %s" % self._save_to_file)
 
     def validateProjectName(self):
         if not self.project_name:
@@ -712,6 +1650,21 @@ class ptSuite:
         if self.project_id is None:
             sys.exit(-1)
 
+    def setAsyncUpload(self, enable=True):
+        if enable and self._async_uploader is None:
+            self._async_uploader = ptAsyncUploader(self._upload, timeout_sec=self._upload_timeout_sec)
+        elif not enable and self._async_uploader is not None:
+            self._async_uploader.stop()
+            self._async_uploader = None
+
+    def flushUploads(self, timeout_sec=None):
+        """
+        Wait for the background uploads (if any), returns False on timeout or upload failure
+        """
+        if self._async_uploader is None:
+            return True
+        return self._async_uploader.flush(timeout_sec)
+
     def upload(self):
         if not self.project_name:
             msg = "Skipping upload() because project name is not specified"
@@ -727,29 +1680,56 @@ class ptSuite:
         if self._auto_end is None:
             self.end = datetime.datetime.now()
 
-        json_prettified = self.toJson(pretty=True)
+        if self._async_uploader is not None and not self._save_to_file:
+            self._async_uploader.schedule()
+            return True
+
+        return self._upload()
+
+    def _upload(self):
+        # only the snapshot is taken under the lock, it is serialized after the lock is released,
+        # so the benchmark adding the scores is not blocked by the serialization
+        with self._lock:
+            tests = None
+            if self._delta_upload and self._delta_synced and not self._save_to_file:
+                tests = [t for t in self.tests if t._dirty]
+            for t in (self.tests if tests is None else tests):
+                t._dirty = False
+            self._delta_synced = False
+            snapshot = None if self._save_to_file else self._jsonSnapshot(tests=tests)
 
         if self._save_to_file:
-            if self._save_to_file == "-":
-                print("Job json:")
-                print(json_prettified)
-            else:
-                with open(self._save_to_file, 'w') as f:
-                    f.write(json_prettified)
-                logging.info("saving json data to %s" % self._save_to_file)
+            self._saveToFile()
             return True
 
-        json_data = self.toJson()
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("posting data to %s:\n%s" %
+                          ('/%d/job/' % self.project_id, "".join(self.iterJson(pretty=True, tests=tests))))
 
-        logging.debug("posting data to %s:\n%s" % ('/%d/job/' % self.project_id, json_prettified))
+        if self._stream_upload:
+            # serialized by the http client while sending, every retry sends the same snapshot
+            def json_data():
+                return (chunk.encode('utf-8') for chunk in self._iterJsonSnapshot(snapshot))
+        else:
+            json_data = "".join(self._iterJsonSnapshot(snapshot))
 
-        response = self.pt_server.post('%d/job/' % self.project_id, decode_json=False, data=json_data)
+        # the job is keyed by the suite uuid, so it is safe to retry the post,
+        # the full job json supersedes all the previous spooled uploads of the job
+        response = self.pt_server.post('%d/job/' % self.project_id, decode_json=False, data=json_data,
+                                       idempotent=True, spool=True, spool_key="job %s" % self.uuid,
+                                       spool_replace=tests is None)
+        if response.spooled:
+            logging.warning("job json upload is spooled, it will be replayed on the next upload")
+            return False
 
         if response.status_code != httplib.OK:
             logging.error("job json upload failed, status %d, %s" % (response.status_code, response.text))
             raise ptRuntimeException("Suite run results upload failed, status %d:\n%s" %
                                      (response.status_code, response.text))
-        logging.info("status %d - job json uploaded, %s" % (response.status_code, response.text))
+        logging.info("status %d - job json uploaded%s, %s" %
+                     (response.status_code, "" if tests is None else " (%d tests changed)" % len(tests),
+                      response.text))
+        self._delta_synced = True
         return True
 
     def addOptions(self, option_parser, pt_url=None, pt_project=None):
@@ -778,6 +1758,16 @@ class ptSuite:
                      help="Upload stdout & stderr to perftracker and attach to the job")
         g.add_option("--pt-log-ttl", type="int", default=180,
                      help="stdout & stderr logs time to live (days), default %default")
+        g.add_option("--pt-async-upload", action="store_true",
+                     help="Upload results from a background thread, do not wait for the portal")
+        g.add_option("--pt-delta-upload", action="store_true",
+                     help="Upload only the tests changed since the previous upload")
+        g.add_option("--pt-stream-upload", action="store_true",
+                     help="Stream the job json to the portal with the chunked transfer encoding")
+        g.add_option("--pt-spool-dir", type="str",
+                     help="Spool the uploads to given directory if the portal is unavailable and replay them later")
+        g.add_option("--pt-compression", type="choice", choices=COMPRESSION_CODECS,
+                     help="Compress the job json upload: %s" % ", ".join(COMPRESSION_CODECS))
         option_parser.add_option_group(g)
 
     def handleOptions(self, options):
@@ -811,6 +1801,16 @@ class ptSuite:
         if _exists(options, 'pt_append'):
             self.uuid = options.pt_append
             self.append = True
+        if _exists(options, 'pt_spool_dir'):
+            self.pt_server.setSpool(options.pt_spool_dir)
+        if _exists(options, 'pt_compression'):
+            self.pt_server.setCompression(options.pt_compression)
+        if _exists(options, 'pt_stream_upload'):
+            self._stream_upload = options.pt_stream_upload
+        if _exists(options, 'pt_delta_upload'):
+            self._delta_upload = options.pt_delta_upload
+        if _exists(options, 'pt_async_upload'):
+            self.setAsyncUpload(options.pt_async_upload)
         if _exists(options, 'pt_log_upload'):
             self._stdout_filename = Tee('stdout').filename
             self._stderr_filename = Tee('stderr').filename
@@ -824,12 +1824,22 @@ class ptSuite:
         self.validateProjectName()
 
     def fini(self):
+        if self._async_uploader is not None:
+            if not self._async_uploader.stop():
+                logging.error("job json background upload failed or timed out")
+            logging.debug("background uploads: %d, coalesced: %d" %
+                          (self._async_uploader.uploads, self._async_uploader.coalesced))
+            self._async_uploader = None
         if self._stdout_artifact and os.path.getsize(self._stdout_filename):
             self._stdout_artifact.upload(self._stdout_filename)
             self._stdout_artifact = None
         if self._stderr_artifact and os.path.getsize(self._stderr_filename):
             self._stderr_artifact.upload(self._stderr_filename)
             self._stderr_artifact = None
+        if self._own_pt_server:
+            logging.debug("perftracker connections: %s" %
+                          ", ".join(["%s=%s" % (k, v) for k, v in self.pt_server.getStats().items()]))
+            self.pt_server.close()
 
     def __del__(self):
         self.fini()
@@ -839,6 +1849,438 @@ class ptSuite:
 # Autotests
 ##############################################################################
 
+class _ptStandInServer:
+    """
+    Minimalistic local stand-in for the perftracker portal, records the decoded requests
+    """
+
+    def __init__(self):
+        stand_in = self
+        self.requests = []  # (method, path, headers, decoded body)
+        self.fail_statuses = []  # statuses to return to the next posts
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, j):
+                body = json.dumps(j).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stand_in.requests.append(("GET", self.path, self.headers, None))
+                if self.path.endswith("/project/"):
+                    return self._reply(httplib.OK, [{'id': 1, 'name': 'Test'}])
+                self._reply(httplib.OK, {'message': 'OK'})
+
+            def _read_body(self):
+                if self.headers.get('Transfer-Encoding', None) != 'chunked':
+                    return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                    if not size:
+                        return b"".join(chunks)
+
+            def do_POST(self):
+                body = self._read_body()
+                encoding = self.headers.get('Content-Encoding', None)
+                if encoding == 'gzip':
+                    body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+                elif encoding == 'zstd':
+                    body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+                stand_in.requests.append(("POST", self.path, self.headers, body))
+                if stand_in.fail_statuses:
+                    return self._reply(stand_in.fail_statuses.pop(0), {'message': 'failure injected'})
+                self._reply(httplib.OK, {'message': 'OK'})
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self._httpd = Server(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def _test_compression(stand_in):
+    for codec in (None,) + COMPRESSION_CODECS:
+        if codec == 'zstd' and zstandard is None:
+            continue
+        suite = ptSuite(project_name="Test", pt_server=ptServer(stand_in.url, compression=codec))
+        for n in range(0, 100):
+            suite.addTest(ptTest("test %d" % n, group="Latency tests", metrics="sec", scores=[0.1 * n]))
+        suite.upload()
+        method, path, headers, body = stand_in.requests[-1]
+        assert path == "/api/v1.0/1/job/"
+        assert headers.get('Content-Encoding', None) == codec
+        assert json.loads(body.decode('utf-8')) == json.loads(suite.toJson())
+
+        # small bodies are sent as is
+        suite.pt_server.setCompression(codec, threshold=2 ** 30)
+        suite.upload()
+        assert stand_in.requests[-1][2].get('Content-Encoding', None) is None
+        suite.fini()
+    print("compression: OK")
+
+
+def _test_retries(stand_in):
+    server = ptServer(stand_in.url, retries=5, retry_budget_sec=0.03)
+    server._getRetryDelay = lambda attempt, response=None: 0.02
+
+    # the budget is per request: every request may wait for one retry, but not for two
+    for n in range(0, 3):
+        stand_in.fail_statuses = [httplib.SERVICE_UNAVAILABLE]
+        assert server.post("/1/job/", data="{}", idempotent=True).status_code == httplib.OK
+    stand_in.fail_statuses = [httplib.SERVICE_UNAVAILABLE] * 2
+    assert server.post("/1/job/", data="{}", idempotent=True).status_code == httplib.SERVICE_UNAVAILABLE
+    stand_in.fail_statuses = []
+    assert server.getStats()['retries'] == 4
+    server.close()
+    print("retries: OK")
+
+
+def _test_async(stand_in):
+    suite = ptSuite(project_name="Test", pt_server=ptServer(stand_in.url), async_upload=True)
+    t = ptTest("latency", scores=[1.0], deviations=[0.1])
+    suite.addTest(t)
+    assert t._lock is suite._lock
+
+    # the test changes wait while the suite is serialized under its lock
+    added = threading.Event()
+    with suite._lock:
+        th = threading.Thread(target=lambda: (t.add_score(2.0), t.add_deviation(0.2), added.set()))
+        th.start()
+        assert not added.wait(0.1) and len(t.scores) == 1
+    th.join()
+    assert len(t.scores) == len(t.deviations) == 2
+
+    for n in range(0, 50):
+        t.add_score(n)
+        t.add_deviation(0.1)
+        suite.upload()
+    assert suite.flushUploads()
+    j = json.loads(stand_in.requests[-1][3].decode('utf-8'))['tests'][0]
+    assert len(j['scores']) == len(j['deviations']) == 52
+
+    # the snapshot is serialized out of the lock: the test changes don't wait for the serialization
+    unblocked = []
+
+    def iter_json_snapshot(*args, **kwargs):
+        th = threading.Thread(target=t.add_score, args=(3.0, ))
+        th.start()
+        th.join(5)
+        unblocked.append(not th.is_alive())
+        return ptSuite._iterJsonSnapshot(*args, **kwargs)
+
+    suite._iterJsonSnapshot = iter_json_snapshot
+    assert suite._upload() and unblocked == [True]
+    del suite._iterJsonSnapshot
+    j = json.loads(stand_in.requests[-1][3].decode('utf-8'))['tests'][0]
+    assert len(j['scores']) == 52 and len(t.scores) == 53
+
+    uploader = suite._async_uploader
+    assert uploader in _pt_async_uploaders
+    suite.fini()
+    assert uploader not in _pt_async_uploaders
+    print("async: OK (%d uploads, %d coalesced)" % (uploader.uploads, uploader.coalesced))
+
+
+def _test_spool(stand_in):
+    import tempfile
+    import shutil
+
+    spool_dir = tempfile.mkdtemp()
+    try:
+        suite = ptSuite(project_name="Test", pt_server=ptServer(stand_in.url, retries=0, spool_dir=spool_dir))
+        suite.addTest(ptTest("test 1", scores=[1.0]))
+
+        stand_in.fail_statuses = [httplib.SERVICE_UNAVAILABLE] * 3
+        assert suite.upload() is False
+        a = suite.addArtifact()
+        resp = a.link([suite.uuid])
+        assert resp.spooled and resp.status_code == httplib.ACCEPTED and "spooled" in resp.json['message']
+        suite.addTest(ptTest("test 2", scores=[2.0]))
+        assert suite.upload() is False  # the spooled requests replay failed, the upload is spooled too
+        assert len(suite.pt_server.spool) == 2, "the full job upload must supersede the older one"
+
+        posts = len([r for r in stand_in.requests if r[0] == "POST"])
+        assert suite.upload() is True
+        replayed = [r for r in stand_in.requests if r[0] == "POST"][posts:]
+        assert [r[1] for r in replayed] == ["/api/v1.0/0/artifact/%s" % a.uuid] + ["/api/v1.0/1/job/"] * 2
+        assert len(json.loads(replayed[1][3].decode('utf-8'))['tests']) == 2
+        assert len(suite.pt_server.spool) == 0
+        suite.fini()
+    finally:
+        shutil.rmtree(spool_dir)
+    print("spool: OK")
+
+
+def _test_streaming(stand_in):
+    suite = ptSuite(project_name="Test", pt_server=ptServer(stand_in.url, compression='gzip'), stream_upload=True)
+    suite.addNode(ptHost("s1", ip="192.168.0.1", cpus=8)).addNode(ptVM("vm1", ip="192.168.100.1", cpus=4))
+    suite.addLink('Grafana', 'http://grafana.localdomain/')
+    for n in range(0, 1000):
+        suite.addTest(ptTest("test %d" % n, group="Latency tests", metrics="sec", scores=[0.1 * n],
+                             attribs={'n': n}))
+
+    for pretty in (False, True):
+        assert "".join(suite.iterJson(pretty=pretty, chunk_size=1024)) == suite.toJson(pretty=pretty)
+        assert "".join(suite.iterJson(pretty=pretty, tests=suite.tests[0:2])) == \
+            suite.toJson(pretty=pretty, tests=suite.tests[0:2])
+    assert len(list(suite.iterJson(chunk_size=1024))) > 10
+
+    suite.upload()
+    method, path, headers, body = stand_in.requests[-1]
+    assert headers.get('Transfer-Encoding', None) == 'chunked'
+    assert json.loads(body.decode('utf-8')) == json.loads(suite.toJson())
+
+    # the json is generated from the snapshot taken by iterJson(), the retries send the same snapshot
+    expected = suite.toJson()
+    chunks = suite.iterJson(chunk_size=1024)
+    first = next(chunks)
+    suite.tests[0].add_score(1.0)
+    suite.addTest(ptTest("test new", scores=[1.0]))
+    assert first + "".join(chunks) == expected
+
+    expected = json.loads(suite.toJson())['tests']
+    suite.pt_server._getRetryDelay = lambda attempt, response=None: suite.tests[0].add_score(2.0) or 0.0
+    stand_in.fail_statuses = [httplib.SERVICE_UNAVAILABLE]
+    suite.upload()
+    assert stand_in.requests[-1][3] == stand_in.requests[-2][3]
+    assert json.loads(stand_in.requests[-1][3].decode('utf-8'))['tests'] == expected
+    suite.fini()
+    print("streaming: OK")
+
+
+def _test_serializer(tests=20000):
+    class _ptReflectiveJsonEncoder(ptJsonEncoder):
+        def default(self, obj):
+            if isinstance(obj, (datetime.datetime, uuid.UUID)):
+                return ptJsonEncoder.default(self, obj)
+            return self.reflect(obj)
+
+    suite = ptSuite(project_name="Test", pt_server=ptServer("127.0.0.1:1"))
+    host = suite.addNode(ptHost("s1", ip="192.168.0.1", cpus=8))
+    host.addNode(ptVM("vm1", virt_type="KVM VM", ip="192.168.100.1", cpus=4))
+    suite.addNode(ptComponent("db", version="1.2"))
+    suite.addLink('Grafana', 'http://grafana.localdomain/')
+    for n in range(0, tests):
+        suite.addTest(ptTest("test %d" % n, group="Latency tests", metrics="sec", scores=[0.1 * n, 0.2 * n],
+                             deviations=[0.01, 0.02], attribs={'n': n}, errors=n % 3))
+
+    assert suite.toJson(pretty=True) == json.dumps(suite, cls=_ptReflectiveJsonEncoder, indent=4,
+                                                   separators=(',', ': '))
+    assert json.loads(suite.toJson()) == json.loads(json.dumps(suite, cls=_ptReflectiveJsonEncoder))
+
+    results = []
+    for name, dumps in (("reflective", lambda: json.dumps(suite, cls=_ptReflectiveJsonEncoder)),
+                        ("to_dict", lambda: json.dumps(suite, cls=ptJsonEncoder)),
+                        ("orjson", suite.toJson if orjson is not None else None)):
+        if dumps is None:
+            continue
+        t = time.time()
+        dumps()
+        results.append("%s %.3f sec" % (name, time.time() - t))
+
+    j = json.loads(suite.toJson())
+    loaded = ptSuite(project_name="Test", pt_server=suite.pt_server)
+    t = time.time()
+    loaded.initFromJson(j)
+    results.append("initFromJson %.3f sec" % (time.time() - t))
+    assert loaded.toJson(pretty=True) == suite.toJson(pretty=True)
+    assert isinstance(loaded.env_nodes[0], ptHost) and isinstance(loaded.env_nodes[0].children[0], ptVM)
+    assert isinstance(loaded.env_nodes[1], ptComponent)
+    assert loaded.getTest("test 7", group="Latency tests") is loaded.tests[7]
+    loaded.addTest(ptTest("new test"))
+    assert loaded.tests[-1].seq_num == tests + 1
+
+    # the loaded tests and nodes are appended by default
+    loaded.initFromJson(j)
+    assert len(loaded.tests) == 2 * tests + 1 and len(loaded.env_nodes) == 4
+    assert loaded.getTest("test 7", group="Latency tests") is loaded.tests[7]
+    loaded.initFromJson(j, replace=True)
+    assert len(loaded.tests) == tests and len(loaded.env_nodes) == 2
+    print("serializer: OK (%d tests: %s)" % (tests, ", ".join(results)))
+
+
+def _test_compact(samples=100000):
+    values = [random.random() * 200 - 50 for _ in range(samples)]
+    t = ptTest("latency", scores=values[0:2], deviations=[0.1, 0.2])
+    ct = ptTest("latency", scores=values[0:2], deviations=[0.1, 0.2], compact=True)
+    t.add_scores(values[2:])
+    started = time.time()
+    ct.add_scores(values[2:])
+    duration = time.time() - started
+    assert list(ct.scores) == t.scores
+    ct.add_deviation(0.3)
+    assert list(ct.deviations) == [0.1, 0.2, 0.3]
+
+    suite = ptSuite(pt_server=ptServer("127.0.0.1:1"))
+    suite.addTest(ct)
+    suite.addTest(ptTest("latency", scores=[1, 2], compact=True))
+    assert len(ct.scores) == samples + 2
+    assert json.loads(suite.toJson())['tests'][0]['scores'] == t.scores + [1, 2]
+    assert json.loads(suite.toJson(pretty=True))['tests'][0]['deviations'] == [0.1, 0.2, 0.3, 0.0, 0.0]
+    print("compact: OK (%d scores: %d bytes, %d bytes in list, add_scores %.3f sec)" %
+          (samples, sys.getsizeof(ct.scores), sys.getsizeof(t.scores) + sum(map(sys.getsizeof, t.scores)), duration))
+
+
+def _test_pt_float(samples=1000000):
+    global numpy
+
+    rnd = random.Random(1)
+    values = [rnd.choice((1, -1)) * 10 ** rnd.uniform(-10, 4) for _ in range(samples)]
+    values += [0, 0.00000001, -0.0, 100, -100, 100.5, 101.5, 0.125, 0.0625, 2.675, 1.005, 99.995, 9.9995,
+               2 ** 60, int(1e25)] + _pt_float_thr + [rnd.randint(-1000, 1000) / 8.0 for _ in range(1000)]
+
+    def tobytes(a):
+        return a.tostring() if _PY2 else a.tobytes()  # array.tobytes() appeared in python 3.2
+
+    started = time.time()
+    expected = tobytes(array.array('d', map(pt_float, values)))
+    results = ["pt_float %.3f sec" % (time.time() - started)]
+
+    backends = [("pt_float_many", None)]
+    if numpy is not None:
+        backends.insert(0, ("pt_float_many (numpy)", numpy))
+    saved_numpy = numpy
+    try:
+        for name, numpy in backends:
+            started = time.time()
+            ret = pt_float_many(values)
+            results.append("%s %.3f sec" % (name, time.time() - started))
+            assert tobytes(ret) == expected, "%s output differs from pt_float()" % name
+            assert list(pt_float_many(iter([0.123456, 1234.5]))) == [0.123, 1234.0]
+    finally:
+        numpy = saved_numpy
+
+    print("pt_float: OK (%d values bit-identical: %s)" % (len(values), ", ".join(results)))
+
+
+def _test_summary(samples=200000):
+    rnd = random.Random(1)
+    values = [rnd.expovariate(100) for _ in range(samples)]
+
+    suite = ptSuite(pt_server=ptServer("127.0.0.1:1"))
+    t = ptTest("latency", metrics="sec", scores=values[0:10], summary=True)
+    suite.addTest(t)
+    for v in values[10:1000]:
+        t.add_score(v)
+    t.add_scores(values[1000:samples // 2])
+    assert not t.scores and len(t.sketch) == samples // 2
+
+    # another worker results: summary or raw scores
+    suite.addTest(ptTest("latency", metrics="sec", scores=values[samples // 2:-10], summary=True))
+    suite.addTest(ptTest("latency", metrics="sec", scores=values[-10:]))
+    assert len(suite.tests) == 1 and len(t.sketch) == samples
+
+    j = json.loads(suite.toJson())['tests'][0]
+    mean = sum(values) / samples
+    assert j['scores'] == [pt_float(mean)] and j['deviations'] == [pt_float(t.sketch.stddev)]
+    p99 = sorted(values)[int(0.99 * (samples - 1))]
+    assert abs(j['attribs']['p99'] - p99) <= p99 * 0.011 and j['attribs']['samples'] == samples
+
+    small = json.loads(ptJsonEncoder.dumps(ptTest("x", scores=[1.0, 2.0], summary=True)))
+    assert type(j['attribs']['samples']) is int and small['attribs']['samples'] == 2
+    assert type(small['attribs']['samples']) is int
+
+    # the scores and deviations lengths stay equal
+    for a, b in ((([1, 2], [0.1, 0.1]), ([3], [])), (([1, 2], []), ([3], [0.3]))):
+        merged = ptTest("latency", scores=a[0], deviations=a[1])
+        merged.merge(ptTest("latency", scores=b[0], deviations=b[1]))
+        assert merged.scores == [1, 2, 3] and len(merged.deviations) == 3 and merged.validate() is None
+
+    raw = ptTest("latency", scores=[1, 2], deviations=[0.1, 0.1])
+    raw.merge(t)
+    assert not raw.scores and not raw.deviations and len(raw.sketch) == samples + 2
+
+    try:
+        t.add_deviation(0.1)
+        assert False, "ptRuntimeException is expected"
+    except ptRuntimeException:
+        pass
+    print("summary: OK (%d samples, p50 %.5f p99 %.5f)" % (samples, j['attribs']['p50'], j['attribs']['p99']))
+
+
+def _test_results_worker(worker):
+    suite = ptSuite(pt_server=ptServer("127.0.0.1:1"))
+    for n in range(0, 100):
+        suite.addTest(ptTest("test %d" % n, group="Latency tests", scores=[n + worker / 10.0], loops=10,
+                             errors=["worker %d error" % worker] if n == 0 else None, duration_sec=2,
+                             status="FAILED" if worker == 2 and n == 1 else "SUCCESS"))
+    t = ptTest("latency", metrics="sec", summary=True)
+    t.add_scores([(worker + 1) * 0.001 * i for i in range(1, 1001)])
+    suite.addTest(t)
+    suite.addTest(ptTest("compact", scores=[worker] * 1000, compact=True))
+    return suite.dumpResults()
+
+
+def _test_results(workers=4):
+    import multiprocessing
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(_test_results_worker, range(workers))
+    finally:
+        pool.close()
+        pool.join()
+
+    suite = ptSuite(pt_server=ptServer("127.0.0.1:1"))
+    for data in results:
+        assert suite.mergeResults(data) == 102
+    assert len(suite.tests) == 102
+
+    t = suite.getTest("test 1", group="Latency tests")
+    assert t.scores == [1.0, 1.1, 1.2, 1.3]
+    assert t.loops == 10 * workers and t.duration_sec == 2 * workers and t.status == "FAILED"
+    assert suite.getTest("test 0", group="Latency tests").errors == ["worker %d error" % w for w in range(workers)]
+    assert suite.getTest("test 2", group="Latency tests").status == "SUCCESS"
+
+    summary = suite.getTest("latency")
+    assert len(summary.sketch) == 1000 * workers and summary.sketch.max == workers * 1.0
+    compact = suite.getTest("compact")
+    assert type(compact.scores) is array.array and len(compact.scores) == 1000 * workers
+
+    for data in (b"garbage", zlib.compress(b'{"version": 0}')):
+        try:
+            suite.mergeResults(data)
+            assert False, "ptRuntimeException is expected"
+        except ptRuntimeException:
+            pass
+    print("results: OK (%d workers, %d bytes of results per worker)" % (workers, len(results[0])))
+
+
+def _test():
+    stand_in = _ptStandInServer()
+    try:
+        _test_compression(stand_in)
+        _test_retries(stand_in)
+        _test_async(stand_in)
+        _test_spool(stand_in)
+        _test_streaming(stand_in)
+        _test_serializer()
+        _test_compact()
+        _test_pt_float()
+        _test_summary()
+        _test_results()
+    finally:
+        stand_in.stop()
+
+
 def _coverage():
     suite = ptSuite(suite_ver="1.0.0", product_name="My web app", product_ver="1.0-1234",
                     project_name="Test", uuid1="11111111-2222-11e8-85cb-8c85907924aa")
@@ -890,6 +2332,7 @@ def _coverage():
 
 
 if __name__ == "__main__":
+    _test()
     try:
         _coverage()
     except ptRuntimeException as e:
@@ -12,14 +12,41 @@ __license__ = "MIT"
 
 import os
 import sys
-import gzip
 import bz2
+import mmap
+import zlib
+import binascii
+import json
+import bisect
+import heapq
+import tempfile
 import datetime
 import logging
 
 from .timeparser import TimeParser, TimeParserException
 
 
+INDEX_SUFFIX = ".ptidx"
+INDEX_VERSION = 1
+INDEX_STEP = 1024 * 1024
+INDEX_DT_FMT = "%Y-%m-%d %H:%M:%S.%f"
+CHECKPOINT_STEP = 8 * 1024 * 1024
+PART_SIZE = 4 * 1024 * 1024
+
+_PY2 = sys.version_info < (3, 0)
+
+_BACKSPACES = (8, 127, b'\x08', b'\x7f')  # '\b' and DEL: bytes items are ints in python3 and bytes in python2
+_CONTROL_BYTES = (b'\r', b'\x08', b'\x7f')
+
+
+def _bytes2int(data):
+    return int(binascii.hexlify(data), 16) if data else 0
+
+
+def _int2bytes(n, length):
+    return binascii.unhexlify('%0*x' % (length * 2, n))
+
+
 class LargeFileException(RuntimeError):
     pass
 
@@ -77,15 +104,496 @@ class FileWithBackspaces:
         self._file_obj.close()
 
 
+class BinaryFileWithBackspaces:
+    """
+    Byte-level FileWithBackspaces: the subclasses find the lines in bytes, only the lines which are read
+    are decoded. tell() and seek() offsets are in bytes. Subclasses implement _read() returning the next
+    raw line split by '\n', seek(), size() and close(), and pass the data they read to _scan_control()
+    """
+
+    _pos = 0
+    _clean_begin = 0  # [begin, end) file range without the control bytes, see _scan_control()
+    _clean_end = 0
+
+    def _scan_control(self, data, offset):
+        """
+        Scan the data read at the offset for the control bytes ('\r' and the backspaces) once, the lines
+        within the clean range are returned as is
+        """
+        last = max([data.rfind(c) for c in _CONTROL_BYTES])
+        if last >= 0:
+            self._clean_begin = offset + last + 1
+        elif offset != self._clean_end:  # not adjacent to the clean range
+            self._clean_begin = offset
+        self._clean_end = offset + len(data)
+
+    def _read_line(self):
+        """
+        _read() with the universal newlines as in the text mode files: '\r' also ends a line, '\r\n' and '\r'
+        line endings become '\n'
+        """
+        begin = self._pos
+        line = self._read()
+        i = line.find(b"\r")
+        if i < 0:
+            return line
+        if line[i + 1:] not in (b"", b"\n"):
+            self._pos = begin + i + 1
+        return line[0:i] + b"\n"
+
+    def readline(self):
+        begin = self._pos
+        line = self._read()
+        if not line:
+            return ""
+        if self._clean_begin <= begin and self._pos < self._clean_end:
+            # fast path: no '\r' in the line and the next line is not a continuation
+            return line.decode('utf-8', 'replace')
+
+        # the same lines joining logic as in FileWithBackspaces.readline()
+        self._pos = begin
+        line = self._read_line()
+        while True:
+            next_pos = self._pos
+            next_line = self._read_line()
+            if not next_line:
+                break
+            if next_line[0] not in _BACKSPACES:
+                self._pos = next_pos
+                break
+
+            while next_line and next_line[0] in _BACKSPACES:
+                for b in (b'\x08', b'\x7f', br'\x08'):
+                    next_line = next_line.lstrip(b)
+                if next_line != b"\n":
+                    break
+                next_line = self._read_line()
+
+            line = line.rstrip(b'\n') + next_line
+
+        return line.decode('utf-8', 'replace')
+
+    def seek_line(self, pos):
+        """
+        Move to the first line starting at or after the pos
+        """
+        if pos <= 0:
+            self.seek(0)
+            return
+        self.seek(pos - 1)
+        self._read()
+
+    def rewind(self):
+        self.seek(0, os.SEEK_SET)
+
+    def tell(self):
+        return self._pos
+
+
+class MmapFileWithBackspaces(BinaryFileWithBackspaces):
+    """
+    Memory-mapped file, the lines are found by mmap.find() in the mapped buffer. The control bytes are
+    scanned by chunk_size windows
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, file_obj):
+        self._file_obj = file_obj
+        self._mm = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pos = 0
+
+    def size(self):
+        return len(self._mm)
+
+    def view(self, begin, end):
+        """
+        Returns zero-copy memoryview of the [begin, end) bytes range, python2 mmap has no buffer interface
+        for memoryview() so the range is copied there
+        """
+        if _PY2:
+            return self._mm[begin:end]
+        return memoryview(self._mm)[begin:end]
+
+    def _read(self):
+        end = self._mm.find(b"\n", self._pos)
+        end = len(self._mm) if end < 0 else end + 1
+        if end >= self._clean_end:
+            begin = self._clean_end if self._clean_begin <= self._pos <= self._clean_end else self._pos
+            self._scan_control(self._mm[begin:max(end + 1, begin + self.chunk_size)], begin)
+        line = self._mm[self._pos:end]
+        self._pos = end
+        return line
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        assert whence == os.SEEK_SET, "only absolute positioning is supported"
+        self._pos = offset
+        return self._pos
+
+    def close(self):
+        self._mm.close()
+        self._file_obj.close()
+
+
+class BufferedFileWithBackspaces(BinaryFileWithBackspaces):
+    """
+    Plain file opened in binary mode and read by chunk_size blocks, the lines are found by bytes.find()
+    in the block. seek() within the buffered block doesn't touch the file
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, file_obj):
+        self._file_obj = file_obj
+        self._pos = 0
+        self._buf = b""
+        self._buf_begin = 0  # file offset of the buffer
+        self._eof = False
+
+    def size(self):
+        return os.fstat(self._file_obj.fileno()).st_size
+
+    def _next_chunk(self):
+        self._file_obj.seek(self._buf_begin + len(self._buf))
+        return self._file_obj.read(self.chunk_size)
+
+    def _fill(self):
+        data = self._next_chunk()
+        drop = min(self._pos - self._buf_begin, len(self._buf))
+        if drop > 0:
+            self._buf = self._buf[drop:]
+            self._buf_begin += drop
+        if not data:
+            self._eof = True
+            return
+        self._scan_control(data, self._buf_begin + len(self._buf))
+        self._buf += data
+
+    def _read(self):
+        while self._pos > self._buf_begin + len(self._buf) and not self._eof:
+            self._fill()
+
+        scan_from = self._pos
+        while True:
+            i = self._buf.find(b"\n", scan_from - self._buf_begin)
+            if i >= 0 or self._eof:
+                break
+            scan_from = self._buf_begin + len(self._buf)
+            self._fill()
+
+        begin = self._pos - self._buf_begin
+        end = i + 1 if i >= 0 else len(self._buf)
+        self._pos = self._buf_begin + max(begin, end)
+        return self._buf[begin:end]
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        assert whence == os.SEEK_SET, "only absolute positioning is supported"
+        if not self._buf_begin <= offset <= self._buf_begin + len(self._buf):
+            self._buf = b""
+            self._buf_begin = offset
+            self._eof = False
+        self._pos = offset
+        return self._pos
+
+    def close(self):
+        self._file_obj.close()
+
+
+class CompressedFileWithBackspaces(BufferedFileWithBackspaces):
+    """
+    Random access to a compressed file: the decompressor state is saved at checkpoints (uncompressed offsets),
+    seek() restores the nearest checkpoint before the offset and decompresses from there instead of from
+    the file beginning. Checkpoints are created as the file is decompressed, see the subclasses for
+    the checkpoints which can be persisted by checkpoints()/load_checkpoints(). The subclasses implement
+    restart_offsets() returning the uncompressed offsets of the persistent checkpoints
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, file_obj, checkpoint_step=CHECKPOINT_STEP):
+        BufferedFileWithBackspaces.__init__(self, file_obj)
+        self._step = checkpoint_step
+        self._cp_offsets = []  # uncompressed offsets of the checkpoints, sorted
+        self._cp_states = []
+        self._size = None  # uncompressed size, known when the whole file is decompressed
+        self._init_checkpoints()
+        self._restore_checkpoint(0)
+
+    def _add_checkpoint(self, offset, state):
+        if not self._cp_offsets or offset > self._cp_offsets[-1]:
+            self._cp_offsets.append(offset)
+            self._cp_states.append(state)
+
+    def _restore_checkpoint(self, n):
+        self._restore(self._cp_states[n])
+        self._out_pos = self._cp_offsets[n]  # uncompressed offset of the next decompressed data
+        self._buf = b""
+        self._buf_begin = self._cp_offsets[n]
+        self._eof = False
+
+    def _next_chunk(self):
+        return self._decompress()
+
+    def _fill(self):
+        BufferedFileWithBackspaces._fill(self)
+        if self._eof:
+            self._size = self._buf_begin + len(self._buf)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        assert whence == os.SEEK_SET, "only absolute positioning is supported"
+        n = bisect.bisect_right(self._cp_offsets, offset) - 1
+        if offset < self._buf_begin or self._cp_offsets[n] > self._buf_begin + len(self._buf):
+            self._restore_checkpoint(n)
+        self._pos = offset
+        return self._pos
+
+    def size(self):
+        if self._size is None:
+            pos = self._pos
+            self.seek(self._cp_offsets[-1])
+            while not self._eof:
+                self._pos = self._buf_begin + len(self._buf)
+                self._fill()
+            self.seek(pos)
+        return self._size
+
+    def checkpoints(self):
+        """
+        Returns json serializable persistent checkpoints and the uncompressed size
+        """
+        self.size()
+        return {'size': self._size, 'checkpoints': self._persistent_checkpoints()}
+
+    def load_checkpoints(self, j):
+        pos = self._pos
+        self._size = j['size']
+        self._load_persistent_checkpoints(j['checkpoints'])
+        self.seek(pos)
+
+
+class GzipFileWithBackspaces(CompressedFileWithBackspaces):
+    """
+    Python zlib doesn't allow to resume the inflate from a bit offset with the saved window (no inflatePrime()),
+    so the checkpoints inside a gzip member keep a copy of the decompressor (~40KB) in memory only and are
+    lost with the reader. Only the gzip members starts (concatenated gzip files, 'bgzip' or
+    'pigz --independent' output) are persistent checkpoints: a new reader of a single member gzip file
+    decompresses it from the beginning
+    """
+
+    def _init_checkpoints(self):
+        self._add_checkpoint(0, (0, None))
+
+    def _restore(self, state):
+        self._in_pos, d = state
+        self._d = d.copy() if d else zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._file_obj.seek(self._in_pos)
+
+    def _decompress(self):
+        while True:
+            # python2 decompressobj has no eof, the data after the member end goes to unused_data there
+            if self._d.unused_data or getattr(self._d, 'eof', False):
+                data = self._d.unused_data
+                member_pos = self._in_pos - len(data)
+                if not data:
+                    data = self._file_obj.read(self.chunk_size)
+                    self._in_pos += len(data)
+                if not data.strip(b"\0"):  # EOF or zero padding after the last member
+                    return b""
+                self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self._add_checkpoint(self._out_pos, (member_pos, None))
+            else:
+                if self._out_pos >= self._cp_offsets[-1] + self._step:
+                    self._add_checkpoint(self._out_pos, (self._in_pos, self._d.copy()))
+                data = self._file_obj.read(self.chunk_size)
+                self._in_pos += len(data)
+                if not data:
+                    return b""  # truncated file
+
+            try:
+                out = self._d.decompress(data)
+            except zlib.error as e:
+                raise LargeFileException("can't decompress %s: %s" % (self._file_obj.name, str(e)))
+            if out:
+                self._out_pos += len(out)
+                return out
+
+    def _persistent_checkpoints(self):
+        return [(offset, state[0]) for offset, state in zip(self._cp_offsets, self._cp_states) if state[1] is None]
+
+    def restart_offsets(self):
+        """
+        Uncompressed offsets of the gzip members starts: a reader with the loaded checkpoints seeks there
+        without decompressing the data before
+        """
+        return [offset for offset, _ in self._persistent_checkpoints()]
+
+    def _load_persistent_checkpoints(self, checkpoints):
+        for offset, in_pos in checkpoints:
+            if offset not in self._cp_offsets:
+                n = bisect.bisect_left(self._cp_offsets, offset)
+                self._cp_offsets.insert(n, offset)
+                self._cp_states.insert(n, (in_pos, None))
+
+
+_BZ2_BLOCK_MAGIC = 0x314159265359
+_BZ2_EOS_MAGIC = 0x177245385090
+
+
+class Bz2FileWithBackspaces(CompressedFileWithBackspaces):
+    """
+    bzip2 blocks are compressed independently and start with a 48-bit magic at arbitrary bit offsets.
+    A block found by the magic is decompressed alone: its bits are shifted to the byte boundary and prepended
+    with a stream header. Every block is a persistent checkpoint: (uncompressed offset, block index).
+    The magic can also occur inside the compressed data, such false hits are dropped when the block which
+    ends there doesn't decompress while the block up to the next hit does
+    """
+
+    def _init_checkpoints(self):
+        self._blocks = []  # [bit offset of the block start, ...]
+        self._eos = []  # bit offsets of the streams ends
+        self._scan_pos = 0  # compressed bytes scanned for the magics
+        self._scanned = False
+        self._add_checkpoint(0, 0)
+
+    def _scan(self):
+        """
+        Scan the next chunk of the file for the blocks starts and the streams ends
+        """
+        found = 0
+        while not found and not self._scanned:
+            self._file_obj.seek(self._scan_pos)
+            buf = self._file_obj.read(self.chunk_size * 16)
+            if len(buf) < self.chunk_size * 16:
+                self._scanned = True
+                buf += b"\0" * 8
+
+            for magic, bits in ((_BZ2_BLOCK_MAGIC, self._blocks), (_BZ2_EOS_MAGIC, self._eos)):
+                new_bits = set()
+                for shift in range(0, 8):
+                    # the magic at the shift bit of the 7-bytes window always covers the window bytes 1..5
+                    pattern = _int2bytes(magic << (8 - shift), 7)[1:6]
+                    i = buf.find(pattern, 1)
+                    while 0 < i <= len(buf) - 6:
+                        if (_bytes2int(buf[i - 1:i + 6]) >> (8 - shift)) & 0xffffffffffff == magic:
+                            new_bits.add((self._scan_pos + i - 1) * 8 + shift)
+                        i = buf.find(pattern, i + 1)
+                for bit in sorted(new_bits):
+                    if not bits or bit > bits[-1]:
+                        bits.append(bit)
+                        found += 1
+
+            self._scan_pos += len(buf) - 7  # the windows crossing the chunk end are scanned with the next chunk
+
+    def _block_end(self, n):
+        """
+        Returns the bit offset of the block end and the list of the magic hits it is taken from
+        """
+        while n + 1 >= len(self._blocks) and not self._scanned:
+            self._scan()
+        end, hits = (self._blocks[n + 1], self._blocks) if n + 1 < len(self._blocks) else (None, None)
+        i = bisect.bisect_right(self._eos, self._blocks[n])
+        if i < len(self._eos) and (end is None or self._eos[i] < end):
+            end, hits = self._eos[i], self._eos
+        if end is None:
+            raise LargeFileException("%s: end of the bzip2 block at bit %d is not found" %
+                                     (self._file_obj.name, self._blocks[n]))
+        return end, hits
+
+    def _restore(self, state):
+        self._block = state
+
+    def _decompress(self):
+        while self._block >= len(self._blocks) and not self._scanned:
+            self._scan()
+        if self._block >= len(self._blocks):
+            return b""
+
+        begin = self._blocks[self._block]
+        end, hits = self._block_end(self._block)
+        try:
+            out = self._decompress_block(begin, end)
+        except LargeFileException as e:
+            # the block is cut at a false magic hit: try the block up to the next hit
+            hits.remove(end)
+            try:
+                out = self._decompress_block(begin, self._block_end(self._block)[0])
+            except LargeFileException:
+                bisect.insort(hits, end)
+                raise e
+
+        self._add_checkpoint(self._out_pos, self._block)
+        self._block += 1
+        self._out_pos += len(out)
+        return out
+
+    def _decompress_block(self, begin, end):
+        """
+        Decompress the [begin, end) bits of the file as a bzip2 block
+        """
+        self._file_obj.seek(begin // 8)
+        data = self._file_obj.read((end + 7) // 8 - begin // 8 + 1)
+        shift = begin % 8
+        word = _bytes2int(data) << shift
+        data = _int2bytes(word & ((1 << (len(data) * 8)) - 1), len(data))[0:(end - begin + 7) // 8]
+
+        d = bz2.BZ2Decompressor()
+        out = []
+        try:
+            chunk = d.decompress(b"BZh9" + data)
+            while chunk:
+                out.append(chunk)
+                chunk = d.decompress(b"")
+        except (IOError, OSError, EOFError) as e:
+            raise LargeFileException("can't decompress %s block at bit %d: %s" % (self._file_obj.name, begin, str(e)))
+        if not out:  # the decompressor waits for the rest of the block
+            raise LargeFileException("can't decompress %s block at bit %d: the block is truncated" %
+                                     (self._file_obj.name, begin))
+        return b"".join(out)
+
+    def _persistent_checkpoints(self):
+        return {'blocks': self._blocks, 'eos': self._eos, 'offsets': self._cp_offsets}
+
+    def restart_offsets(self):
+        """
+        Uncompressed offsets of the decompressed blocks
+        """
+        return list(self._cp_offsets)
+
+    def _load_persistent_checkpoints(self, checkpoints):
+        self._blocks = checkpoints['blocks']
+        self._eos = checkpoints['eos']
+        self._scanned = True
+        self._cp_offsets = checkpoints['offsets']
+        self._cp_states = list(range(0, len(self._cp_offsets)))
+
+
 class LargeLogFile:
     """
     Extracts parts of a log file based on a begin_time and end_time (both are optional)
     Uses binary search logic for fast search
+
+    use_mmap - memory-map uncompressed files: lines are searched in the mapped buffer and the matched range
+               is available as zero-copy memoryview by range_view()
+    index    - keep a sparse index of the timestamps taken every index_step bytes and persist it to
+               the filename.ptidx sidecar file, so range searches of the same file (see set_range()) only probe
+               the lines within index_step
+
+    .gz and .bz2 files are always searched with the index, the sidecar file also keeps the persistent
+    decompressor checkpoints: the bzip2 blocks and the gzip members starts. The checkpoints inside a gzip member
+    are created every checkpoint_step uncompressed bytes and are kept in memory only, see GzipFileWithBackspaces
+    and Bz2FileWithBackspaces. The first range search reads the whole file to build them
     """
 
-    def __init__(self, filename, begin_time=None, end_time=None):
+    def __init__(self, filename, begin_time=None, end_time=None, use_mmap=False, index=False,
+                 index_step=INDEX_STEP, checkpoint_step=CHECKPOINT_STEP):
         self.filename = filename
         self._timeparser = TimeParser()
+        self._use_mmap = use_mmap
+        self._use_index = index
+        self._index_step = index_step
+        self._checkpoint_step = checkpoint_step
+        self._index = None  # [(line begin pos, datetime), ...] sorted by pos
+        self._index_dts = None
 
         if begin_time is not None:
             if type(begin_time) == str:
@@ -108,6 +616,12 @@ class LargeLogFile:
 
         self._open()
 
+    def _to_datetime(self, t):
+        if isinstance(t, str):
+            t, _ = self._timeparser.parse(t)
+        assert t is None or isinstance(t, datetime.datetime), "Unsupported time type: " + str(type(t))
+        return t
+
     def _open(self):  # pragma: no cover
         if self.filename == '-':
             self.begin_time = None
@@ -115,22 +629,108 @@ class LargeLogFile:
             self._file_obj = sys.stdin
             return
 
-        if self.filename.endswith(".gz"):
-            f = gzip.open(self.filename, 'r')
-        elif self.filename.endswith(".bz2"):
-            f = bz2.BZ2File(self.filename, 'r')
+        if self.filename.endswith(".gz") or self.filename.endswith(".bz2"):
+            cls = GzipFileWithBackspaces if self.filename.endswith(".gz") else Bz2FileWithBackspaces
+            self._file_obj = cls(open(self.filename, 'rb'), self._checkpoint_step)
+            self._use_index = True
+            self.set_range(self.begin_time, self.end_time)
+            return
+        elif self._use_mmap and os.path.getsize(self.filename):
+            self._file_obj = MmapFileWithBackspaces(open(self.filename, 'rb'))
         else:
-            f = open(self.filename, 'r')  # FIXME: we need rb for correct behaviour on Windows
-        self._file_obj = FileWithBackspaces(f)
+            self._file_obj = BufferedFileWithBackspaces(open(self.filename, 'rb'))
+
+        self.set_range(self.begin_time, self.end_time)
+
+    def _is_mmap(self):
+        return isinstance(self._file_obj, MmapFileWithBackspaces)
+
+    def _is_compressed(self):
+        return isinstance(self._file_obj, CompressedFileWithBackspaces)
+
+    def set_range(self, begin_time=None, end_time=None):
+        """
+        Select another range of the file (both bounds are optional), the next fetch_line() starts from its beginning
+        """
+        self.begin_time = self._to_datetime(begin_time)
+        self.end_time = self._to_datetime(end_time)
+        self._range_begin_pos = None
+        self._range_end_pos = None
 
-        self._range_begin_pos = self._find_pos(self.begin_time) if self.begin_time else None
-        self._range_end_pos = self._find_pos(self.end_time, before=False) if self.end_time else None
+        if (self.begin_time or self.end_time) and not isinstance(self._file_obj, BinaryFileWithBackspaces):
+            raise LargeFileException("can't search the time range in the stdin")
+        range_begin_pos = self._offsets_find_pos(self.begin_time) if self.begin_time else None
+        range_end_pos = self._offsets_find_pos(self.end_time) if self.end_time else None
+        self._range_begin_pos, self._range_end_pos = range_begin_pos, range_end_pos
 
         self.rewind()
 
         if self._range_begin_pos:
             self._file_obj.seek(self._range_begin_pos, os.SEEK_SET)
 
+    def set_range_pos(self, begin_pos, end_pos, checkpoints=None):
+        """
+        Select the lines starting within [begin_pos, end_pos) bytes of the file (mmap mode or compressed file),
+        see split_range(). checkpoints are the checkpoints() of the reader which has split the file: they are
+        loaded instead of the index, so the compressed file is not decompressed to build it if the index
+        sidecar file can't be saved
+        """
+        if not isinstance(self._file_obj, BinaryFileWithBackspaces):
+            raise LargeFileException("set_range_pos() is not supported for the stdin")
+        if self._is_compressed():
+            if checkpoints is not None:
+                self._file_obj.load_checkpoints(checkpoints)
+            else:
+                self._get_index()  # loads the checkpoints
+        self._range_begin_pos, self._range_end_pos = begin_pos, end_pos
+        self._file_obj.seek_line(begin_pos)
+
+    def split_range(self, part_size=PART_SIZE):
+        """
+        Split the selected range into [(begin pos, end pos), ...] parts of about part_size bytes, the parts can be
+        read independently (e.g. in other processes) by set_range_pos(). Parts of compressed files begin at
+        the restart offsets only (see restart_offsets()), so a part can be larger than part_size
+        """
+        if not isinstance(self._file_obj, BinaryFileWithBackspaces):
+            raise LargeFileException("split_range() is not supported for the stdin")
+
+        begin = self._range_begin_pos or 0
+        end = self._range_end_pos if self._range_end_pos is not None else self._file_obj.size()
+        if self._is_compressed():
+            self._get_index()
+            restarts = [pos for pos in self._file_obj.restart_offsets() if begin < pos < end]
+        else:
+            restarts = range(begin + part_size, end, part_size)
+
+        parts = []
+        for pos in restarts:
+            if pos - begin >= part_size:
+                parts.append((begin, pos))
+                begin = pos
+        if begin < end:
+            parts.append((begin, end))
+        return parts
+
+    def checkpoints(self):
+        """
+        Returns the json serializable decompressor checkpoints of a compressed file for set_range_pos()
+        of other readers, None for the plain files
+        """
+        if not self._is_compressed():
+            return None
+        self._get_index()
+        return self._file_obj.checkpoints()
+
+    def range_view(self):
+        """
+        Returns zero-copy memoryview of the raw bytes of the selected range (mmap mode only, a copy on python2)
+        """
+        if not self._is_mmap():
+            raise LargeFileException("range_view() requires an uncompressed file opened with use_mmap=True")
+        begin = self._range_begin_pos if self._range_begin_pos is not None else 0
+        end = self._range_end_pos if self._range_end_pos is not None else self._file_obj.size()
+        return self._file_obj.view(begin, end)
+
     def close(self):
         if self._file_obj != sys.stdout:
             self._file_obj.close()
@@ -155,7 +755,7 @@ class LargeLogFile:
             if not line:
                 return None, None
             try:
-                dt, tail = self._timeparser.parse(str(line))
+                dt, tail = self._timeparser.parse(line)
                 return dt, tail.strip()
             except TimeParserException:
                 pass
@@ -167,75 +767,239 @@ class LargeLogFile:
                 break
             yield dt, tail
 
-    def _find_pos(self, needle_dt, before=True):
+    def _next_line_with_time(self, pos, limit):
         """
-        Binary search a file for matching lines.
-        Returns the first line in the file which has datetime >= needle_dt
+        Returns (begin pos, datetime) of the first line with time starting at or after pos and before limit,
+        (None, None) if there is no such line
         """
+        f = self._file_obj
+        f.seek_line(pos)
+        while True:
+            begin = f.tell()
+            if begin >= limit:
+                return None, None
+            line = f.readline()
+            if not line:
+                return None, None
+            try:
+                dt, _ = self._timeparser.parse(line)
+                return begin, dt
+            except TimeParserException:
+                pass
+
+    def _offsets_find_pos(self, needle_dt):
+        """
+        Lower-bound binary search over the (uncompressed) file bytes offsets: returns the begin position of
+        the first line with datetime >= needle_dt, or the file size if there is no such line
+        """
+        index = self._get_index() if self._use_index else None  # loads the compressed file size as well
+        size = self._file_obj.size()
+        lo, hi = 0, size
+
+        if index is not None:
+            i = bisect.bisect_left(self._index_dts, needle_dt)
+            if i > 0:
+                lo = index[i - 1][0]
+            if i < len(index):
+                hi = index[i][0]
 
-        # Must be greater than the maximum length of any line.
-        max_line_len = 2 ** 16
+        # invariants: all the lines with time starting before lo have datetime < needle_dt,
+        # the first line with time starting at or after hi has datetime >= needle_dt (or doesn't exist)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            begin, dt = self._next_line_with_time(mid, hi)
+            if dt is None or dt >= needle_dt:
+                hi = mid
+            else:
+                lo = self._file_obj.tell()
+
+        begin, dt = self._next_line_with_time(lo, size)
+        return size if begin is None else begin
+
+    def _index_filename(self):
+        return self.filename + INDEX_SUFFIX
+
+    def _get_index(self):
+        if self._index is not None:
+            return self._index
+
+        st = os.stat(self.filename)
+        header = {'version': INDEX_VERSION, 'size': st.st_size, 'mtime': st.st_mtime, 'step': self._index_step}
+
+        try:
+            with open(self._index_filename(), 'r') as f:
+                j = json.load(f)
+            if all([j.get(k, None) == v for k, v in header.items()]):
+                index = [(pos, datetime.datetime.strptime(dt, INDEX_DT_FMT)) for pos, dt in j['index']]
+                if self._is_compressed():
+                    self._file_obj.load_checkpoints(j['checkpoints'])
+                self._index = index
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+
+        if self._index is None:
+            self._index = self._build_index()
+            header['index'] = [(pos, dt.strftime(INDEX_DT_FMT)) for pos, dt in self._index]
+            if self._is_compressed():
+                header['checkpoints'] = self._file_obj.checkpoints()
+            self._save_index(header)
+
+        self._index_dts = [dt for _, dt in self._index]
+        return self._index
+
+    def _build_index(self):
+        index = []
+        size = self._file_obj.size()
+        for pos in range(0, size, self._index_step):
+            begin, dt = self._next_line_with_time(pos, size)
+            if begin is None:
+                break
+            if index and begin == index[-1][0]:
+                continue
+            if index and dt < index[-1][1]:
+                logging.warning("%s: time goes backwards at %d, the index is not used" % (self.filename, begin))
+                return []
+            index.append((begin, dt))
+        return index
+
+    def _save_index(self, j):
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=dirname)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(j, f)
+            os.rename(tmp, self._index_filename())
+        except (IOError, OSError) as e:  # pragma: no cover
+            logging.debug("can't save %s index: %s" % (self.filename, str(e)))
+
+
+def _log_set_split(filename, begin_time, end_time, part_size, index):
+    f = LargeLogFile(filename, begin_time, end_time, use_mmap=True, index=index)
+    try:
+        return f.split_range(part_size), f.checkpoints()
+    finally:
+        f.close()
+
+
+def _log_set_iter(filename, begin_pos, end_pos, index, checkpoints):
+    f = LargeLogFile(filename, use_mmap=True, index=index)
+    try:
+        f.set_range_pos(begin_pos, end_pos, checkpoints)
+        for rec in f.readlines_with_time():
+            yield rec
+    finally:
+        f.close()
 
-        self._file_obj.seek(0, os.SEEK_END)
 
-        start = pos = 0
-        end = self._file_obj.tell()
+def _log_set_read(filename, begin_pos, end_pos, index, checkpoints):
+    return list(_log_set_iter(filename, begin_pos, end_pos, index, checkpoints))
 
-        # Limit the number of times we search
-        for repeat in range(50):
 
-            if end <= start:
-                return end
+class _InlineResult:
+    def __init__(self, func, args):
+        self._value = func(*args)
 
-            last = pos
-            prev_line_end_pos = self._curr_line_end_pos
-            delta = ((end - start) // 2)
+    def get(self):
+        return self._value
 
-            # Move the cursor to a newline boundary, ensure it is moved
-            while prev_line_end_pos == self._curr_line_end_pos:
-                pos = start + delta
-                self._file_obj.seek(pos)
 
-                line_dt, line_tail = self.fetch_line()
-                if not line_dt:
-                    # last try
-                    delta = 0
-                    prev_line_end_pos = self._curr_line_end_pos
-                    continue
+class _StreamResult:
+    """
+    The part read lazily in this process by _log_set_iter()
+    """
 
-                if delta == 0:
-                    if before:
-                        return start if line_dt >= needle_dt else end
-                    else:
-                        return start if line_dt >= needle_dt else end
-                delta //= 2
+    def __init__(self, args):
+        self._args = args
 
-            if not line_dt:
-                return start
+    def get(self):
+        return _log_set_iter(*self._args)
 
-            if line_dt == needle_dt or pos == last:
 
-                # Seek back until we no longer have a match
-                while True:
-                    self._file_obj.seek(max(0, -max_line_len), os.SEEK_SET)
-                    dt, _ = self.fetch_line()
-                    if dt != needle_dt:
-                        break
+class LargeLogSet:
+    """
+    Time-ordered merge of the same time range of many log files (plain, .gz or .bz2). The range search and
+    the lines parsing run in a pool of workers processes: the selected range of every file is split into
+    parts of about part_size bytes (see LargeLogFile.split_range()), at most prefetch parts per file are
+    read ahead, so the memory doesn't depend on the range size. Compressed files can only be split at
+    the restart offsets (e.g. a single member .gz file is not split at all), the parts larger than
+    2 * part_size are read lazily in this process instead of by the workers.
+
+    workers - number of the worker processes, None - the number of CPUs, 0 - read the files in this process
+    index   - keep the sparse timestamps index for the plain files as well, see LargeLogFile
 
-                # Seek forward to the first match
-                for rpt in range(max_line_len):
-                    dt, _ = self.fetch_line()
-                    if dt == needle_dt:
-                        break
+    Usage:
+        for dt, tail, filename in LargeLogSet(filenames, begin_time, end_time).readlines_with_time():
+            ...
+    """
 
-                return self._curr_line_begin_pos
+    def __init__(self, filenames, begin_time=None, end_time=None, workers=None, part_size=PART_SIZE, prefetch=2,
+                 index=False):
+        self.filenames = list(filenames)
+        self.begin_time = begin_time
+        self.end_time = end_time
+        self.workers = workers
+        self.part_size = part_size
+        self.prefetch = max(1, prefetch)
+        self.index = index
 
-            elif line_dt < needle_dt:
-                start = self._curr_line_end_pos
+    def _read_ahead(self, apply, filename, parts, pending, checkpoints):
+        while parts and len(pending) < self.prefetch:
+            begin_pos, end_pos = parts.pop(0)
+            args = (filename, begin_pos, end_pos, self.index, checkpoints)
+            if end_pos - begin_pos > 2 * self.part_size:
+                pending.append(_StreamResult(args))
             else:
-                end = self._curr_line_begin_pos
+                pending.append(apply(_log_set_read, args))
+
+    def _file_records(self, apply, filename, parts, pending, checkpoints):
+        while pending:
+            result = pending.pop(0)
+            self._read_ahead(apply, filename, parts, pending, checkpoints)
+            for rec in result.get():
+                yield rec
+
+    def readlines_with_time(self):
+        """
+        Yields (datetime, tail, filename) of the lines within the range of all the files ordered by time,
+        the lines with the same time are ordered by the files order
+        """
+        pool = None
+        if self.workers == 0:
+            apply = _InlineResult
         else:
-            raise LargeFileException('Binary search failed')  # pragma: no cover
+            import multiprocessing
+            pool = multiprocessing.Pool(self.workers)
+            apply = pool.apply_async
+
+        try:
+            splits = [apply(_log_set_split, (fn, self.begin_time, self.end_time, self.part_size, self.index))
+                      for fn in self.filenames]
+            readers = []
+            for fn, split in zip(self.filenames, splits):
+                (parts, checkpoints), pending = split.get(), []
+                self._read_ahead(apply, fn, parts, pending, checkpoints)
+                readers.append(self._file_records(apply, fn, parts, pending, checkpoints))
+
+            # k-way merge, the heap has one record per file so the (datetime, file #) pairs are unique
+            heap = []
+            for n, reader in enumerate(readers):
+                for dt, tail in reader:
+                    heap.append((dt, n, tail))
+                    break
+            heapq.heapify(heap)
+
+            while heap:
+                dt, n, tail = heap[0]
+                yield dt, tail, self.filenames[n]
+                for dt, tail in readers[n]:
+                    heapq.heapreplace(heap, (dt, n, tail))
+                    break
+                else:
+                    heapq.heappop(heap)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
 
 
 ##############################################################################
@@ -244,16 +1008,20 @@ class LargeLogFile:
 
 
 def _coverage():
+    import io
+    import shutil
+
     dir_path = os.path.dirname(os.path.realpath(__file__))
+    cases = [(10, None, None),
+             (9, None, "2018-06-05 04:05:01"),
+             (6, "2018-05-05 02:01:00.012000", None),
+             (0, "2018-05-05 00:00:00", "2018-05-05 00:00:03"),
+             (10, "2018-05-05 00:00:00", "2020-05-05 00:00:00"),
+             (2, "2018-05-05 00:00:00", datetime.datetime.strptime('May 5 2018  1:02AM', '%b %d %Y %I:%M%p')),
+             (5, "2018-05-05 03:04:00", "2018-06-10 03:04:00")]
 
     for filename in ['large_file.txt', 'large_file.gz', 'large_file.tgz']:
-        for case in [(10, None, None),
-                     (9, None, "2018-06-05 04:05:01"),
-                     (6, "2018-05-05 02:01:00.012000", None),
-                     (0, "2018-05-05 00:00:00", "2018-05-05 00:00:03"),
-                     (10, "2018-05-05 00:00:00", "2020-05-05 00:00:00"),
-                     (2, "2018-05-05 00:00:00", datetime.datetime.strptime('May 5 2018  1:02AM', '%b %d %Y %I:%M%p')),
-                     (5, "2018-05-05 03:04:00", "2018-06-10 03:04:00")]:
+        for case in cases:
             lines, begin, end = case
             f = LargeLogFile(os.path.join(dir_path, '.testdata', 'large_file.txt'), begin, end)
             seen_lines = [l for l in f.readlines_with_time()]
@@ -264,6 +1032,207 @@ def _coverage():
             print("file %s, case '%s': OK" % (filename, str(case)))
             f.close()
 
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'large_file.txt')
+        shutil.copy(os.path.join(dir_path, '.testdata', 'large_file.txt'), filename)
+
+        expected = {}
+        for case in cases:
+            f = LargeLogFile(filename, case[1], case[2])
+            expected[case] = list(f.readlines_with_time())
+            f.close()
+
+        for kwargs in ({}, {'index': True, 'index_step': 64}, {'index': True, 'index_step': 64}, {'index': True}):
+            f = LargeLogFile(filename, use_mmap=True, **kwargs)
+            for case in cases:
+                f.set_range(case[1], case[2])
+                seen_lines = list(f.readlines_with_time())
+                assert seen_lines == expected[case], "mmap %s, case '%s' failed:\n  %s" % \
+                    (str(kwargs), case, "\n  ".join(["%s %s" % (d, l) for d, l in seen_lines]))
+                view = f.range_view()
+                assert len(seen_lines) == len([ln for ln in bytes(view).split(b"\n") if ln[0:1].isdigit()])
+                if not _PY2:
+                    view.release()
+            print("mmap %s: OK" % str(kwargs))
+            f.close()
+        assert os.path.exists(filename + INDEX_SUFFIX)
+
+        # compressed files: single and multi member gzip, multi stream bz2
+        with open(filename, 'rb') as f:
+            data = f.read()
+        parts = [data[0:len(data) // 3], data[len(data) // 3:]]
+
+        def gzip_compress(chunk):
+            c = zlib.compressobj(9, zlib.DEFLATED, 31)
+            return c.compress(chunk) + c.flush()
+
+        compressed = {'single.gz': gzip_compress(data),
+                      'multi.gz': b"".join([gzip_compress(p) for p in parts]),
+                      'multi.bz2': b"".join([bz2.compress(p) for p in parts])}
+        chunk_size = CompressedFileWithBackspaces.chunk_size
+        CompressedFileWithBackspaces.chunk_size = 64  # to get the checkpoints inside the gzip members
+        for name, blob in sorted(compressed.items()):
+            fname = os.path.join(tmpdir, name)
+            with open(fname, 'wb') as f:
+                f.write(blob)
+            for attempt in ("build", "load"):
+                f = LargeLogFile(fname, index_step=64, checkpoint_step=256)
+                for case in reversed(cases):
+                    f.set_range(case[1], case[2])
+                    seen_lines = list(f.readlines_with_time())
+                    assert seen_lines == expected[case], "%s %s, case '%s' failed:\n  %s" % \
+                        (name, attempt, case, "\n  ".join(["%s %s" % (d, l) for d, l in seen_lines]))
+                f.rewind()
+                assert list(f.readlines_with_time()) == expected[cases[0]]
+                f.close()
+            assert os.path.exists(fname + INDEX_SUFFIX)
+            print("%s: OK" % name)
+        CompressedFileWithBackspaces.chunk_size = chunk_size
+
+        # false bzip2 magic hits inside the blocks are dropped
+        f = Bz2FileWithBackspaces(open(os.path.join(tmpdir, 'multi.bz2'), 'rb'))
+        while not f._scanned:
+            f._scan()
+        blocks, eos = list(f._blocks), list(f._eos)
+        assert len(blocks) == len(eos) == 2
+        f._blocks.insert(1, (blocks[0] + eos[0]) // 2)
+        f._eos.insert(1, (blocks[1] + eos[1]) // 2)
+        assert b"".join(iter(f._read, b"")) == data
+        assert f._blocks == blocks and f._eos == eos and f.restart_offsets() == [0, len(parts[0])]
+        f.close()
+        print("bz2 false magic: OK")
+
+        # truncated and corrupted files
+        for cls, blob in ((GzipFileWithBackspaces, compressed['single.gz'] + b"\0" * 16),
+                          (GzipFileWithBackspaces, compressed['single.gz'][0:-100]),
+                          (GzipFileWithBackspaces, compressed['single.gz'][0:100] + b"x" * 100),
+                          (Bz2FileWithBackspaces, compressed['multi.bz2'][0:-100]),
+                          (Bz2FileWithBackspaces, b"x".join([compressed['multi.bz2'][0:100],
+                                                             compressed['multi.bz2'][200:]]))):
+            fname = os.path.join(tmpdir, 'broken')
+            with open(fname, 'wb') as f:
+                f.write(blob)
+            f = cls(open(fname, 'rb'), 256)
+            try:
+                assert f.size() <= len(data)
+                f.seek(0)
+                assert f.readline().startswith(data.split(b"\n")[0].decode())
+            except LargeFileException:
+                pass
+            f.close()
+
+        # time-ordered merge of many files
+        empty = os.path.join(tmpdir, 'empty.txt')
+        open(empty, 'w').close()
+        names = [filename, empty] + [os.path.join(tmpdir, name) for name in sorted(compressed.keys())]
+        for case in cases:
+            exp = sorted([(dt, n, tail) for n in (0, 2, 3, 4) for dt, tail in expected[case]], key=lambda r: r[0:2])
+            for workers in (0, 2):
+                s = LargeLogSet(names, case[1], case[2], workers=workers, part_size=128, prefetch=2, index=True)
+                seen = list(s.readlines_with_time())
+                assert seen == [(dt, tail, names[n]) for dt, n, tail in exp], \
+                    "log set, workers %d, case '%s' failed" % (workers, case)
+
+        # the readers of the parts get the checkpoints from the split, not from the index
+        for name in sorted(compressed.keys()):
+            fname = os.path.join(tmpdir, name)
+            os.remove(fname + INDEX_SUFFIX)
+            parts, checkpoints = _log_set_split(fname, None, None, 128, False)
+            os.remove(fname + INDEX_SUFFIX)
+            f = LargeLogFile(fname)
+            f.set_range_pos(parts[-1][0], parts[-1][1], checkpoints)
+            lines = list(f.readlines_with_time())
+            assert lines and lines == expected[cases[0]][-len(lines):]
+            assert f._index is None and not os.path.exists(fname + INDEX_SUFFIX)
+            f.close()
+
+        # the not split compressed parts are read lazily in this process
+        fname = os.path.join(tmpdir, 'single.gz')
+        parts, checkpoints = _log_set_split(fname, None, None, 128, False)
+        assert len(parts) == 1 and parts[0][1] - parts[0][0] > 256
+        pending = []
+        LargeLogSet([fname], part_size=128)._read_ahead(_InlineResult, fname, parts, pending, checkpoints)
+        assert isinstance(pending[0], _StreamResult) and list(pending[0].get()) == expected[cases[0]]
+        print("log set: OK")
+
+        # the byte-level reader returns the same lines as the text one, tell() is exact
+        text_f = FileWithBackspaces(open(filename, 'r'))
+        text_lines, text_offsets = [], []
+        for line in iter(text_f.readline, ""):
+            text_lines.append(line)
+            text_offsets.append(text_f.tell())
+        f = BufferedFileWithBackspaces(open(filename, 'rb'))
+        f.chunk_size = 16
+        lines, offsets = [], []
+        for line in iter(f.readline, ""):
+            lines.append(line)
+            offsets.append(f.tell())
+        assert lines == text_lines and offsets == text_offsets and offsets[-1] == f.size() == len(data)
+        f.seek(offsets[1])
+        assert f.readline() == lines[2]
+        f.close()
+
+        # '\r' and the backspaces: the universal newlines and the continuation lines as in the text mode
+        fname = os.path.join(tmpdir, 'control.txt')
+        with open(fname, 'wb') as f:
+            f.write(b"2018-05-05 00:00:01 a\r\n2018-05-05 00:00:02 b\rc\n\x08 d\r\n\x08\r\n\x7fe\n"
+                    b"2018-05-05 00:00:03 f\r\r\n" * 3 + b"g\rh")
+        f = FileWithBackspaces(io.open(fname, 'r', encoding='utf-8'))
+        control_lines = list(iter(f.readline, ""))
+        f.close()
+        for cls, chunk_size in ((BufferedFileWithBackspaces, 1), (BufferedFileWithBackspaces, 7),
+                                (BufferedFileWithBackspaces, 1024), (MmapFileWithBackspaces, 5),
+                                (MmapFileWithBackspaces, 1024)):
+            f = cls(open(fname, 'rb'))
+            f.chunk_size = chunk_size
+            lines, offsets = [], []
+            for line in iter(f.readline, ""):
+                lines.append(line)
+                offsets.append(f.tell())
+            assert lines == control_lines, "%s %d: %s" % (cls.__name__, chunk_size, lines)
+            for n, offset in enumerate(offsets):
+                f.seek(offset)
+                assert list(iter(f.readline, "")) == lines[n + 1:]
+            f.close()
+
+        f = LargeLogFile(filename)
+        f._file_obj.close()
+        f._file_obj = text_f
+        text_f.rewind()
+        for exc_cb in (lambda: f.split_range(), lambda: f.set_range_pos(0, 1), lambda: f.set_range(cases[-1][1])):
+            try:
+                exc_cb()
+                assert False, "LargeFileException is expected"
+            except LargeFileException:
+                pass
+        f.close()
+
+        # unsorted file: the index is not used, but the search works for the sorted parts
+        with open(filename, 'w') as f:
+            f.write("2018-05-05 03:00:00 a\n2018-05-05 02:00:00 b\n2018-05-05 04:00:00 c\nd\n")
+        f = LargeLogFile(filename, "2018-05-05 04:00:00", use_mmap=True, index=True, index_step=10)
+        assert [tail for _, tail in f.readlines_with_time()] == ["c"]
+        f.close()
+
+        # non-ascii lines are passed to the time parser decoded, as is
+        with open(filename, 'wb') as f:
+            f.write(u"2018-05-05 03:00:00 caf\u00e9\n2018-05-05 04:00:00 \u00fcber\n".encode('utf-8'))
+        for use_mmap in (False, True):
+            f = LargeLogFile(filename, use_mmap=use_mmap)
+            assert [tail for _, tail in f.readlines_with_time()] == [u"caf\u00e9", u"\u00fcber"]
+            f.close()
+
+        f = LargeLogFile(filename, "2018-05-05 03:04:00")
+        try:
+            f.range_view()
+            assert False, "LargeFileException is expected"
+        except LargeFileException:
+            pass
+        f.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
     print("OK")
 
 
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import, division
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""Mergeable streaming summary of a samples stream: count, mean, stddev, min, max and quantiles
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class SketchException(RuntimeError):
+    pass
+
+
+class QuantileSketch:
+    """
+    Log-bucketed histogram (DDSketch-like): a sample v > 0 is counted in the bucket
+    ceil(log(v) / log(gamma)), gamma = (1 + accuracy) / (1 - accuracy), so every quantile is estimated with
+    the given relative accuracy. Memory depends on the samples range, not on the number of samples:
+    ~700 buckets cover 1us..1000s with 1% accuracy. Negative samples are kept in a mirrored histogram.
+    Mean and stddev are exact (Welford's algorithm)
+    """
+
+    def __init__(self, accuracy=0.01):
+        if not 0 < accuracy < 1:
+            raise SketchException("accuracy must be in (0, 1) range, got: %s" % str(accuracy))
+        self.accuracy = accuracy
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0  # sum of squared differences from the mean
+        self._zeros = 0
+        self._pos = {}  # bucket index -> samples count
+        self._neg = {}
+        self._gamma = (1.0 + accuracy) / (1.0 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def __len__(self):
+        return self.count
+
+    def _bucket(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _value(self, index):
+        return 2.0 * self._gamma ** index / (self._gamma + 1.0)
+
+    def add(self, value):
+        value = float(value)
+        if math.isnan(value) or math.isinf(value):
+            raise SketchException("can't add %s to the sketch" % str(value))
+        if value > 0:
+            i = self._bucket(value)
+            self._pos[i] = self._pos.get(i, 0) + 1
+        elif value < 0:
+            i = self._bucket(-value)
+            self._neg[i] = self._neg.get(i, 0) + 1
+        else:
+            self._zeros += 1
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def add_many(self, values):
+        if numpy is None:
+            # validate all the values first: the sketch is not changed if any of them can't be added
+            values = [float(v) for v in values]
+            for v in values:
+                if math.isnan(v) or math.isinf(v):
+                    raise SketchException("can't add nan or inf to the sketch")
+            for v in values:
+                self.add(v)
+            return
+
+        v = numpy.fromiter(values, dtype=numpy.float64) if not hasattr(values, '__len__') else \
+            numpy.asarray(values, dtype=numpy.float64)
+        if not len(v):
+            return
+        if not numpy.isfinite(v).all():
+            raise SketchException("can't add nan or inf to the sketch")
+
+        for values, buckets in ((v[v > 0], self._pos), (-v[v < 0], self._neg)):
+            if len(values):
+                indexes, counts = numpy.unique(numpy.ceil(numpy.log(values) / self._log_gamma).astype(numpy.int64),
+                                               return_counts=True)
+                for i, c in zip(indexes.tolist(), counts.tolist()):
+                    buckets[i] = buckets.get(i, 0) + c
+        self._zeros += int((v == 0).sum())
+
+        other = QuantileSketch(self.accuracy)
+        other.count = len(v)
+        other.mean = float(v.mean())
+        other._m2 = float(((v - other.mean) ** 2).sum())
+        other.min = float(v.min())
+        other.max = float(v.max())
+        self._mergeMoments(other)
+
+    def _mergeMoments(self, other):
+        # Chan et al. parallel variance algorithm
+        count = self.count + other.count
+        if not count:
+            return
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def merge(self, other):
+        """
+        Add the other sketch samples to this one, the sketches must have the same accuracy
+        """
+        if abs(other.accuracy - self.accuracy) > 1e-12:
+            raise SketchException("can't merge sketches with different accuracy: %s and %s" %
+                                  (str(self.accuracy), str(other.accuracy)))
+        for buckets, other_buckets in ((self._pos, other._pos), (self._neg, other._neg)):
+            for i, c in other_buckets.items():
+                buckets[i] = buckets.get(i, 0) + c
+        self._zeros += other._zeros
+        self._mergeMoments(other)
+        return self
+
+    @property
+    def stddev(self):
+        """
+        Sample standard deviation
+        """
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.count - 1))
+
+    def quantile(self, q):
+        """
+        Returns the q-quantile (0 <= q <= 1) estimate: quantile(0.99) is p99
+        """
+        if not 0 <= q <= 1:
+            raise SketchException("quantile must be in [0, 1] range, got: %s" % str(q))
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        value = None
+        for i in sorted(self._neg.keys(), reverse=True):
+            seen += self._neg[i]
+            if seen > rank:
+                value = -self._value(i)
+                break
+        if value is None:
+            seen += self._zeros
+            if seen > rank:
+                value = 0.0
+        if value is None:
+            for i in sorted(self._pos.keys()):
+                seen += self._pos[i]
+                if seen > rank:
+                    value = self._value(i)
+                    break
+        return min(max(value, self.min), self.max)
+
+    def summary(self):
+        """
+        Returns dict with samples, mean, stddev, min, max, p50, p90, p99 and p99.9
+        """
+        ret = {'samples': self.count, 'mean': self.mean, 'stddev': self.stddev, 'min': self.min, 'max': self.max}
+        for name, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p99.9', 0.999)):
+            ret[name] = self.quantile(q)
+        return ret
+
+    def to_dict(self):
+        """
+        Json serializable sketch state, see from_dict()
+        """
+        return {'accuracy': self.accuracy, 'count': self.count, 'mean': self.mean, 'm2': self._m2,
+                'min': self.min, 'max': self.max, 'zeros': self._zeros,
+                'pos': [[i, c] for i, c in sorted(self._pos.items())],
+                'neg': [[i, c] for i, c in sorted(self._neg.items())]}
+
+    @staticmethod
+    def from_dict(j):
+        s = QuantileSketch(j['accuracy'])
+        s.count = j['count']
+        s.mean = j['mean']
+        s._m2 = j['m2']
+        s.min = j['min']
+        s.max = j['max']
+        s._zeros = j['zeros']
+        s._pos = dict([(i, c) for i, c in j['pos']])
+        s._neg = dict([(i, c) for i, c in j['neg']])
+        return s
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    global numpy
+    import random
+    import json
+
+    rnd = random.Random(1)
+    values = [rnd.lognormvariate(0, 1) for _ in range(20000)] + [0.0, -1.5, -0.5]
+    exact = sorted(values)
+
+    for use_numpy in (True, False):
+        saved_numpy = numpy
+        if not use_numpy:
+            numpy = None
+        try:
+            s1, s2 = QuantileSketch(), QuantileSketch()
+            for v in values[0:5000]:
+                s1.add(v)
+            s2.add_many(iter(values[5000:]))
+            s = QuantileSketch.from_dict(json.loads(json.dumps(s1.to_dict()))).merge(s2)
+        finally:
+            numpy = saved_numpy
+
+        assert len(s) == len(values)
+        mean = sum(values) / len(values)
+        assert abs(s.mean - mean) < 1e-9
+        assert abs(s.stddev - math.sqrt(sum([(v - mean) ** 2 for v in values]) / (len(values) - 1))) < 1e-9
+        assert s.min == -1.5 and s.max == max(values)
+        for q in (0.0, 0.0001, 0.5, 0.9, 0.99, 0.999, 1.0):
+            e = exact[int(q * (len(values) - 1))]
+            assert abs(s.quantile(q) - e) <= abs(e) * s.accuracy + 1e-12, "q %s: %s != %s" % (q, s.quantile(q), e)
+
+    summary = s.summary()
+    assert summary['samples'] == len(values) and summary['p50'] == s.quantile(0.5)
+
+    assert QuantileSketch().quantile(0.5) is None
+    assert QuantileSketch().stddev == 0.0
+    saved_numpy, before = numpy, s.to_dict()
+    try:
+        for numpy in (saved_numpy, None):  # the same exceptions with and without numpy, the sketch is not changed
+            for exc_cb in (lambda: QuantileSketch(accuracy=2), lambda: s.quantile(2), lambda: s.add(float('nan')),
+                           lambda: s.add(float('-inf')), lambda: s.merge(QuantileSketch(accuracy=0.02)),
+                           lambda: s.add_many([float('inf')]), lambda: s.add_many([1.0, float('nan')])):
+                try:
+                    exc_cb()
+                    assert False, "exception is expected"
+                except SketchException:
+                    pass
+    finally:
+        numpy = saved_numpy
+    assert s.to_dict() == before
+
+    n = len(s)
+    s.add_many([])
+    assert len(s) == n
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""Durable on-disk FIFO queue of requests to be replayed later
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import shutil
+
+SPOOL_SUFFIX = ".spool"
+REJECTED_SUFFIX = ".rejected"
+
+
+class SpoolException(RuntimeError):
+    pass
+
+
+class Spool:
+    """
+    Every entry is a file with a json header line followed by the raw body. Entries are written to a
+    temporary file, fsync-ed and renamed, so a crash never leaves a partial entry in the queue.
+    The oldest entries are evicted when the spool exceeds max_bytes or max_entries
+    """
+
+    def __init__(self, dirname, max_bytes=256 * 1024 * 1024, max_entries=10000):
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._seq = 0
+
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def __len__(self):
+        return len(self.entries())
+
+    def _path(self, name):
+        return os.path.join(self.dirname, name)
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(self.dirname, os.O_RDONLY)
+        except OSError:  # pragma: no cover
+            return  # Windows doesn't allow to open directories
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def entries(self):
+        """
+        Returns the entries names, the oldest first
+        """
+        return sorted([n for n in os.listdir(self.dirname) if n.endswith(SPOOL_SUFFIX)])
+
+    def size(self):
+        return sum([os.path.getsize(self._path(n)) for n in self.entries()])
+
+    def put(self, meta, body, replaces=None):
+        """
+        meta     - json serializable dict describing the entry
+        body     - entry data: bytes, str or an iterable of bytes chunks (written as they are generated)
+        replaces - drop older entries with meta['key'] == replaces, they are superseded by this one
+        """
+        if not isinstance(body, bytes) and hasattr(body, 'encode'):
+            body = body.encode('utf-8')
+
+        if replaces is not None:
+            for name in self.entries():
+                if self.get_meta(name).get('key', None) == replaces:
+                    logging.debug("spool %s: %s is superseded by the new entry" % (self.dirname, name))
+                    self.remove(name)
+
+        # names are sorted by time, the sequence number keeps the order of entries put in the same microsecond
+        self._seq += 1
+        name = "%016d-%06d-%08d%s" % (int(time.time() * 1000000), os.getpid() % 1000000, self._seq, SPOOL_SUFFIX)
+
+        fd, tmp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=self.dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(meta).encode('utf-8') + b"\n")
+                for chunk in ([body] if isinstance(body, bytes) else body):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self._path(name))
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self._fsync_dir()
+
+        self._evict()
+        return name
+
+    def _evict(self):
+        entries = self.entries()
+        sizes = [os.path.getsize(self._path(n)) for n in entries]
+        total = sum(sizes)
+        while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+            logging.warning("spool %s is full (%d entries, %d bytes), evicting the oldest entry %s" %
+                            (self.dirname, len(entries), total, entries[0]))
+            self.remove(entries.pop(0))
+            total -= sizes.pop(0)
+
+    def get_meta(self, name):
+        with open(self._path(name), 'rb') as f:
+            return json.loads(f.readline().decode('utf-8'))
+
+    def get(self, name):
+        """
+        Returns (meta, body) of the entry
+        """
+        with open(self._path(name), 'rb') as f:
+            meta = json.loads(f.readline().decode('utf-8'))
+            return meta, f.read()
+
+    def remove(self, name):
+        try:
+            os.unlink(self._path(name))
+        except OSError:
+            pass  # already replayed by a concurrent flush
+
+    def reject(self, name):
+        """
+        Move the entry out of the queue, but keep it for investigation
+        """
+        os.rename(self._path(name), self._path(name[:-len(SPOOL_SUFFIX)] + REJECTED_SUFFIX))
+
+    def replay(self, send_cb):
+        """
+        Call send_cb(meta, body) for every entry, the oldest first. send_cb must return True if the entry
+        is delivered, False to stop replaying (i.e. the server is still unavailable) and None
+        if the entry must be rejected. Returns the number of delivered entries
+        """
+        delivered = 0
+        for name in self.entries():
+            try:
+                meta, body = self.get(name)
+            except (IOError, OSError):
+                continue  # already replayed by a concurrent flush
+            ret = send_cb(meta, body)
+            if ret is None:
+                logging.error("spool %s: entry %s is rejected" % (self.dirname, name))
+                self.reject(name)
+            elif ret:
+                self.remove(name)
+                delivered += 1
+            else:
+                break
+        return delivered
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    dirname = tempfile.mkdtemp()
+    try:
+        spool = Spool(os.path.join(dirname, "spool"), max_entries=3)
+
+        spool.put({'n': 1, 'key': 'a'}, b"body1")
+        spool.put({'n': 2, 'key': 'b'}, "body2")
+        spool.put({'n': 3, 'key': 'a'}, b"body3", replaces='a')
+        assert [spool.get(n)[0]['n'] for n in spool.entries()] == [2, 3]
+
+        spool.put({'n': 4}, iter([b"bo", b"dy4"]))
+        spool.put({'n': 5}, b"body5")
+        assert [spool.get(n)[0]['n'] for n in spool.entries()] == [3, 4, 5], "eviction failed"
+        assert spool.size() == sum([len(json.dumps(spool.get(n)[0])) + 6 for n in spool.entries()])
+        assert not [n for n in os.listdir(spool.dirname) if n.endswith(".tmp")]
+
+        seen = []
+
+        def send(meta, body):
+            seen.append(body)
+            if meta['n'] == 4:
+                return None
+            return len(seen) < 3
+
+        assert spool.replay(send) == 1
+        assert seen == [b"body3", b"body4", b"body5"]
+        assert len(spool) == 1
+        assert len([n for n in os.listdir(spool.dirname) if n.endswith(REJECTED_SUFFIX)]) == 1
+
+        assert spool.replay(lambda meta, body: True) == 1
+        assert len(spool) == 0
+    finally:
+        shutil.rmtree(dirname)
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
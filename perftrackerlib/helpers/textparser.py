@@ -10,9 +10,126 @@ __license__ = "MIT"
 """The library to work efficiently with very large log files
 """
 
+import os
 import re
+import codecs
+import itertools
+from array import array
 from pydoc import locate
 
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+CHUNK_SIZE = 1024 * 1024
+PART_SIZE = 4 * 1024 * 1024  # approximate size of the file parts parsed by the workers, see ptParser.parse_file()
+
+_GLOBAL_FLAGS = re.compile(r'\(\?[aiLmsux]+\)')
+
+try:
+    _INT64 = array('q').typecode
+except ValueError:  # pragma: no cover
+    _INT64 = 'l'  # python2: no 'q'
+
+_ARRAY_TYPECODES = {int: _INT64, float: 'd'}
+
+
+class TextParserException(RuntimeError):
+    pass
+
+
+def _skip_item(regexp, i):
+    """
+    Returns the position after the regexp item (group, class, escape or special character) at the i-th position
+    """
+    c = regexp[i]
+    if c == '\\':
+        return min(i + 2, len(regexp))
+    if c not in '([':
+        return i + 1
+
+    depth = 0
+    while i < len(regexp):
+        c = regexp[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            i += 2 if regexp[i + 1:i + 2] == '^' else 1
+            i += 1  # ']' right after '[' or '[^' is a literal
+            while i < len(regexp) and regexp[i] != ']':
+                i += 2 if regexp[i] == '\\' else 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        i += 1
+        if not depth:
+            break
+    return min(i, len(regexp))
+
+
+def _skip_quantifier(regexp, i):
+    q = regexp[i:i + 1]
+    if q == '{':
+        i = regexp.find('}', i)
+        i = len(regexp) if i < 0 else i + 1
+    elif q and q in '*+?':
+        i += 1
+    else:
+        return i
+    return i + 1 if regexp[i:i + 1] in ('?', '+') else i  # lazy and possessive quantifiers
+
+
+def _literals(regexp):
+    """
+    Returns (prefix, literals): the literal text every match of the regexp begins with and the list of literal
+    texts every match contains. Both are empty if the regexp is too complex to find them out. The regexp is
+    a string or a compiled pattern
+    """
+    if hasattr(regexp, 'pattern'):
+        if regexp.flags & (re.IGNORECASE | re.VERBOSE):  # the text is not matched literally
+            return "", []
+        regexp = regexp.pattern
+    if _GLOBAL_FLAGS.search(regexp):
+        return "", []
+
+    prefix, run, literals = None, "", []
+    i = 1 if regexp.startswith('^') else 0
+    while i < len(regexp):
+        c = regexp[i]
+        if c == '\\' and i + 1 < len(regexp) and not regexp[i + 1].isalnum():
+            c = regexp[i + 1]
+            i += 2
+        elif c == '|':
+            return "", []  # top level alternation, the groups are skipped as a whole
+        elif c in '\\.^$*+?{}[]()':
+            c = None
+            i = _skip_item(regexp, i)
+        else:
+            i += 1
+
+        quantifier = regexp[i:i + 1]
+        if c is not None and quantifier not in ('*', '?', '{'):
+            run += c
+            if quantifier != '+':
+                continue
+
+        # the literal run is over: the item is not a literal or it is repeated
+        if prefix is None:
+            prefix = run
+        if run:
+            literals.append(run)
+        run = ""
+        i = _skip_quantifier(regexp, i)
+
+    if prefix is None:
+        prefix = run
+    if run:
+        literals.append(run)
+    return prefix, literals
+
 
 class ptRowParser:
     def __init__(self, regexp, obj_cb, parse_once=True):
@@ -20,10 +137,19 @@ class ptRowParser:
         self._regexp = regexp
         self.obj_cb = obj_cb
         self.parse_once = parse_once
+        self.prefix, literals = _literals(regexp)
+        self.literal = max(literals, key=len) if literals else ""  # the longest text every match contains
 
-    def search(self, line, match=True):
-        m = self.regexp.match(line) if match else self.regexp.search(line)
+    def _match(self, line, match):
+        # literals prefilter, it is much cheaper than the regexp
+        if match and self.prefix and not line.startswith(self.prefix):
+            return None
+        if self.literal and self.literal not in line:
+            return None
+        return self.regexp.match(line) if match else self.regexp.search(line)
 
+    def search(self, line, match=True):
+        m = self._match(line, match)
         if m:
             if type(self.obj_cb) == list:
                 for obj_cb in self.obj_cb:
@@ -34,24 +160,293 @@ class ptRowParser:
         return False
 
 
+class ptTableParser(ptRowParser):
+    """
+    Row parser which collects the regexp groups into typed columns instead of calling back per match.
+
+    schema - list of (group, type) pairs or dict, group is the group name or number, type is int, float, str,
+             the type name ('int', ...) or any callable converting the group text
+
+    The matched groups texts are kept as is and converted column by column every flush_rows rows, the int and
+    float columns are 64-bit int and double arrays, the other ones are lists. Every group of the schema must
+    participate in the match. The rows are added to the columns only if all of them are converted, the rows
+    which fail the conversion are dropped.
+    """
+
+    flush_rows = 64 * 1024
+
+    def __init__(self, regexp, schema, parse_once=False):
+        ptRowParser.__init__(self, regexp, None, parse_once)
+        self.columns = []  # [(group, type, column), ...]
+        for group, t in (schema.items() if hasattr(schema, 'items') else schema):
+            if not (group in self.regexp.groupindex or group in range(0, self.regexp.groups + 1)):
+                raise TextParserException("no group '%s' in the regexp: %s" % (str(group), self._regexp))
+            if not callable(t):
+                t = locate(t)
+                if not callable(t):
+                    raise TextParserException("unknown type of the '%s' group: %s" % (str(group), str(t)))
+            code = _ARRAY_TYPECODES.get(t)
+            self.columns.append((group, t, array(code) if code else []))
+
+        if not self.columns:
+            raise TextParserException("empty schema for the regexp: %s" % self._regexp)
+
+        # the not converted groups texts of the last rows, all the rows groups in one flat list
+        self._groups = [group for group, t, column in self.columns]
+        self._rows = []
+        self._add = self._rows.append if len(self._groups) == 1 else self._rows.extend
+        self._flush_len = self.flush_rows * len(self._groups)
+
+    def search(self, line, match=True):
+        m = self._match(line, match)
+        if m:
+            self._add(m.group(*self._groups))
+            if len(self._rows) >= self._flush_len:
+                self._flush()
+            return True
+        return False
+
+    def _add_rows(self, rows):
+        """
+        Add the rows collected by a parse_file() worker, rows is the flat list of the groups texts
+        """
+        self._rows.extend(rows)
+        if len(self._rows) >= self._flush_len:
+            self._flush()
+
+    def _flush(self):
+        try:
+            values = []
+            for n, (group, t, column) in enumerate(self.columns):
+                texts = self._rows[n::len(self.columns)]
+                try:
+                    values.append(array(column.typecode, map(t, texts)) if isinstance(column, array) else
+                                  list(map(t, texts)))
+                except (TypeError, ValueError, OverflowError) as e:
+                    raise TextParserException("can't convert the '%s' group: %s" % (str(group), str(e)))
+            for (group, t, column), v in zip(self.columns, values):
+                column.extend(v)
+        finally:
+            del self._rows[:]
+
+    def table(self, as_numpy=False):
+        """
+        Returns {group: column} of all the rows parsed so far, the columns are numpy arrays if as_numpy is True
+        """
+        self._flush()
+        if not as_numpy:
+            return dict([(group, column) for group, t, column in self.columns])
+        if numpy is None:
+            raise TextParserException("numpy is not installed")
+        return dict([(group, numpy.array(column)) for group, t, column in self.columns])
+
+
+def _split_file(filename, part_size):
+    """
+    Returns [(begin_pos, end_pos), ...] - parts of about part_size bytes of the file, every part but the last one
+    ends right after a '\\n'
+    """
+    size = os.path.getsize(filename)
+    parts = []
+    with open(filename, 'rb') as f:
+        begin_pos = 0
+        while begin_pos < size:
+            f.seek(begin_pos + max(part_size, 1) - 1)
+            f.readline()
+            end_pos = min(f.tell(), size)
+            parts.append((begin_pos, end_pos))
+            begin_pos = end_pos
+    return parts
+
+
+def _parse_part(filename, begin_pos, end_pos, specs, match, unique, encoding):
+    """
+    Parse the file part by the row parsers specs [(row parser number, regexp, groups), ...], groups are the table
+    parser groups to collect in the worker or None. Returns [(lines, {row parser number: rows}), ...] in the file
+    order: the lines to be parsed in the caller process, then the table parsers rows (the flat lists of the
+    groups texts, see ptTableParser) of the lines which only the tables parsers match
+    """
+    with open(filename, 'rb') as f:
+        f.seek(begin_pos)
+        lines = f.read(end_pos - begin_pos).decode(encoding, 'replace').split("\n")
+    if not lines[-1]:
+        lines.pop()
+
+    hits = []  # [(line number, row parser number, match), ...]
+    current = [0]
+
+    def numbered(lines):
+        for n, line in enumerate(lines):
+            current[0] = n
+            yield line
+
+    p = ptParser()
+    for number, regexp, groups in specs:
+        p.add_row_parser(regexp, lambda m, number=number: hits.append((current[0], number, m)), parse_once=False)
+    p.parse_text(numbered(lines), match, unique)
+
+    tables = dict([(number, groups) for number, regexp, groups in specs if groups])
+    result = [([], {})]
+    for n, line_hits in itertools.groupby(hits, key=lambda h: h[0]):
+        line_hits = list(line_hits)
+        if [number for _, number, _ in line_hits if number not in tables]:
+            if result[-1][1]:
+                result.append(([], {}))
+            result[-1][0].append(lines[n])
+            continue
+        for _, number, m in line_hits:
+            rows = result[-1][1].setdefault(number, [])
+            groups = tables[number]
+            if len(groups) > 1:
+                rows.extend(m.group(*groups))
+            else:
+                rows.append(m.group(groups[0]))
+    return result
+
+
 class ptParser:
     def __init__(self):
         self.row_parsers = []
+        self._dispatch = {}  # the literal prefixes beginnings -> the row parsers numbers to try, see _build_dispatch()
+        self._dispatch_len = 1  # length of the beginnings: the shortest literal prefix length
+        self._no_prefix = []  # numbers of the row parsers without literal prefix
+        self._by_literal = []  # the required literals -> the row parsers numbers to try in the search mode
+        self._no_literal = []  # numbers of the row parsers without required literal
+        self._active = []
 
     def add_row_parser(self, regexp, obj_cb, parse_once=True):
         self.row_parsers.append(ptRowParser(regexp, obj_cb, parse_once))
 
+    def add_table_parser(self, regexp, schema, parse_once=False):
+        """
+        Add the row parser collecting the regexp groups into typed columns, see ptTableParser.
+        Returns the row parser, its table() gives the columns after the parsing
+        """
+        p = ptTableParser(regexp, schema, parse_once)
+        self.row_parsers.append(p)
+        return p
+
+    def _build_dispatch(self):
+        self._active = [n for n, p in enumerate(self.row_parsers) if p]
+        self._no_prefix = [n for n in self._active if not self.row_parsers[n].prefix]
+        prefixes = [len(self.row_parsers[n].prefix) for n in self._active if self.row_parsers[n].prefix]
+        self._dispatch_len = min(prefixes) if prefixes else 1
+
+        by_beginning = {}
+        for n in self._active:
+            if self.row_parsers[n].prefix:
+                by_beginning.setdefault(self.row_parsers[n].prefix[0:self._dispatch_len], []).append(n)
+        self._dispatch = dict([(b, sorted(numbers + self._no_prefix)) for b, numbers in by_beginning.items()])
+
+        by_literal = {}
+        for n in self._active:
+            if self.row_parsers[n].literal:
+                by_literal.setdefault(self.row_parsers[n].literal, []).append(n)
+        self._by_literal = list(by_literal.items())
+        self._no_literal = [n for n in self._active if not self.row_parsers[n].literal]
+
     def parse_text(self, lines, match=True, unique=True):
+        # in the match mode a line is only tried by the row parsers without literal prefix and the ones with
+        # the prefix which begins as the line, in the search mode - by the ones without required literal and the
+        # ones with the literal the line contains. So most of the lines are rejected by a few substring searches
+        # only. The tables are rebuilt when a parse_once row parser retires, the parsing stops when the last one does
+        self._build_dispatch()
+        if not self._active:
+            return
         for line in lines:
-            n_parsers = len(self.row_parsers)
+            if match:
+                parsers = self._dispatch.get(line[0:self._dispatch_len], self._no_prefix)
+            else:
+                parsers = [n for literal, numbers in self._by_literal if literal in line for n in numbers]
+                if self._no_literal:
+                    parsers = sorted(parsers + self._no_literal)
+                elif len(parsers) > 1:
+                    parsers.sort()
 
-            for n in range(0, n_parsers):
-                if self.row_parsers[n] and self.row_parsers[n].search(line, match):
-                    if self.row_parsers[n].parse_once:
+            for n in parsers:
+                p = self.row_parsers[n]
+                if p and p.search(line, match):
+                    if p.parse_once:
                         self.row_parsers[n] = None
+                        self._build_dispatch()
+                        if not self._active:
+                            return
                     if unique:
                         break
 
+    def parse_stream(self, stream, match=True, unique=True, encoding='utf-8', chunk_size=CHUNK_SIZE):
+        """
+        Parse a binary or text file object or an iterable of bytes or str chunks. The chunks are split into
+        lines (without the '\\n') and the lines of every chunk are parsed by parse_text(), so the memory
+        usage does not depend on the stream size.
+        The reading stops as soon as all the row parsers are parse_once ones and all of them have fired.
+        Returns True if the stream has been read till the end
+        """
+        chunks = iter(lambda: stream.read(chunk_size) or None, None) if hasattr(stream, 'read') else stream
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+        tail = ""
+        for chunk in chunks:
+            lines = (tail + (decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)).split("\n")
+            tail = lines.pop()
+            self.parse_text(lines, match, unique)
+            if not self._active:
+                return False
+
+        tail += decoder.decode(b"", True)
+        if tail:
+            self.parse_text([tail], match, unique)
+        return True
+
+    def parse_file(self, filename, match=True, unique=True, encoding='utf-8', workers=0, part_size=PART_SIZE,
+                   prefetch=2):
+        """
+        Parse a large plain text file, in a pool of worker processes if workers is not 0. The file is split into
+        parts of about part_size bytes at the line boundaries, the workers get the parts byte ranges and parse
+        them. The rows of the table parsers (but parse_once ones) are collected in the workers, the lines matched
+        by the other row parsers are parsed by parse_text() in this process in the file order. So the callbacks
+        are called in this process with the same matches in the same order as parse_stream() of the file calls
+        them, both parse_once and unique semantics hold, the tables get the same rows. The parsing stops as soon
+        as all the row parsers are parse_once ones and all of them have fired.
+
+        workers  - number of the worker processes, None - the number of CPUs, 0 - parse the file in this process
+                   by parse_stream(). The workers pay off for the table parsers on many CPUs, the lines matched
+                   by the callbacks row parsers are parsed twice
+        prefetch - number of the parts parsed ahead per worker
+
+        Returns True if the file has been read till the end
+        """
+        if workers == 0:
+            with open(filename, 'rb') as f:
+                return self.parse_stream(f, match, unique, encoding)
+
+        self._build_dispatch()
+        specs = []
+        for n in self._active:
+            p = self.row_parsers[n]
+            specs.append((n, p._regexp, p._groups if isinstance(p, ptTableParser) and not p.parse_once else None))
+
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        prefetch *= workers or multiprocessing.cpu_count()
+        try:
+            parts, pending = _split_file(filename, part_size), []
+            while parts or pending:
+                while parts and len(pending) < max(1, prefetch):
+                    begin_pos, end_pos = parts.pop(0)
+                    pending.append(pool.apply_async(_parse_part, (filename, begin_pos, end_pos, specs, match, unique,
+                                                                  encoding)))
+                for lines, tables in pending.pop(0).get():
+                    self.parse_text(lines, match, unique)
+                    if not self._active:
+                        return False
+                    for n, rows in tables.items():
+                        self.row_parsers[n]._add_rows(rows)
+            return True
+        finally:
+            pool.terminate()
+            pool.join()
+
 
 ##############################################################################
 # Autotests
@@ -59,6 +454,12 @@ class ptParser:
 
 
 def _coverage():
+    global numpy
+    import io
+    import time
+    import itertools
+    import tempfile
+    import multiprocessing
 
     class TestClass:
         def __init__(self):
@@ -105,6 +506,206 @@ def _coverage():
     assert t3.float == 0.0
     assert t3.str == "yyy"
 
+    for regexp, prefix, literals in ((r"int: (\d+)", "int: ", ["int: "]), (r"^a\.b\d", "a.b", ["a.b"]),
+                                     (r"ab*c", "a", ["a", "c"]), (r"ab+c", "ab", ["ab", "c"]), (r"ab{2}", "a", ["a"]),
+                                     (r"a|b", "", []), (r"(?i)abc", "", []), (r"abc(?i)", "", []),
+                                     (r"[a]bc", "", ["bc"]), (r"a\ b\s", "a b", ["a b"]), ("a\\", "a", ["a"]),
+                                     (r"(a|b)cd[]x)]ef(?:g)+?hi", "", ["cd", "ef", "hi"]),
+                                     (r"x(?P<a>\d+)?yz", "x", ["x", "yz"]), (r"a{1,2}?bc", "", ["bc"]),
+                                     (r"[^]]+q$", "", ["q"]), (r"(?i:ab)cd", "", ["cd"]), (r"a{", "", []),
+                                     (r"\bfoo\b", "", ["foo"]), (r"abc", "abc", ["abc"]),
+                                     (re.compile(r"a\.b"), "a.b", ["a.b"]), (re.compile(r"ab", re.I), "", []),
+                                     (re.compile(r"a b", re.X), "", [])):
+        assert _literals(regexp) == (prefix, literals), "%s: %s" % (regexp, _literals(regexp))
+
+    # the dispatch gives the same results as trying all the row parsers
+    def naive_parse_text(row_parsers, lines, match, unique):
+        for line in lines:
+            for n in range(0, len(row_parsers)):
+                if row_parsers[n] and row_parsers[n].search(line, match):
+                    if row_parsers[n].parse_once:
+                        row_parsers[n] = None
+                    if unique:
+                        break
+
+    regexps = [r"int: (\d+)", r"int: (\d+), str", r"float: ([\d\.]+)", r"i\w+: (\d+)", r".*: (\d+)", r"str: (.*)",
+               r"(?i)INT: (\d+)", r"x?str: (\w+)", r"int|str", r"(\d+), (x?)str: yyy", r"\d+, float",
+               re.compile(r"FLOAT: ([\d\.]+)", re.IGNORECASE), re.compile(r"str:\ (\w) # comment", re.VERBOSE)]
+    # all the row parsers have required literals, so the lines without them are not tried at all
+    with_literals = [r for r in regexps if _literals(r)[1]]
+    for match, unique, regexps in itertools.product((True, False), (True, False), (regexps, with_literals)):
+        results = []
+        for naive in (True, False):
+            seen = []
+            p = ptParser()
+            for n, regexp in enumerate(regexps):
+                p.add_row_parser(regexp, lambda m, n=n: seen.append((n, m.group(0))), parse_once=(n % 3 == 1))
+            if naive:
+                naive_parse_text(p.row_parsers, text * 2, match, unique)
+            else:
+                p.parse_text(text * 2, match, unique)
+            results.append(seen)
+        assert results[0] == results[1], "match %s, unique %s, regexps %s" % (match, unique, regexps)
+    assert len(results[0]) > len(text)
+
+    # parse_stream() gives the same results as parse_text() for any chunks
+    text.append(u"str: \u0436\u0436")
+    data = "\n".join(text).encode('utf-8')
+    for stream, parse_once in ((io.BytesIO(data), False), (io.StringIO(data.decode('utf-8')), False),
+                               ([data[i:i + 7] for i in range(0, len(data), 7)], False), ([data + b"\n"], False),
+                               ([data[0:40], data[40:]], True)):
+        results = []
+        for streaming in (True, False):
+            seen = []
+            p = ptParser()
+            for n, regexp in enumerate(regexps):
+                p.add_row_parser(regexp, lambda m, n=n: seen.append((n, m.group(0))), parse_once=parse_once)
+            if streaming:
+                assert p.parse_stream(stream, chunk_size=5) or parse_once
+            else:
+                p.parse_text(text)
+            results.append(seen)
+        assert results[0] == results[1], "%s: %s != %s" % (str(stream), results[0], results[1])
+    assert (5, u"str: \u0436\u0436") in results[0]
+
+    # the stream is not read any more when all the parse_once row parsers have fired
+    read = []
+
+    def chunks():
+        for chunk in (b"int: 1\n", b"int: 2, str: x\n", b"int: 3\n"):
+            read.append(chunk)
+            yield chunk
+
+    p = ptParser()
+    p.add_row_parser(r"int: (\d+)$", lambda m: None)
+    p.add_row_parser(r"int: (\d+), str", lambda m: None)
+    assert p.parse_stream(chunks()) is False and len(read) == 2
+    assert p.parse_stream([b"int: 3"]) is False
+    p.parse_text(["int: 4"])
+
+    # the table parsers give the same values as the callbacks
+    p = ptParser()
+    flush_rows, ptTableParser.flush_rows = ptTableParser.flush_rows, 2
+    t = p.add_table_parser(r"int: (?P<int>\d+), float: (?P<float>[\d\.]+), x?str: (?P<str>.*)",
+                           {'int': int, 'float': 'float', 'str': str})
+    ptTableParser.flush_rows = flush_rows
+    t1 = p.add_table_parser(r"int: (\d+)", [(1, 'int')])
+    p.parse_text(text)
+    assert t.table() == {'int': array(_INT64, [12, 13, 15, 16]), 'float': array('d', [1.23, 1.24, 1.25, 1.26]),
+                         'str': ["xxx", "xxx", "zzz", "aaa"]}, t.table()
+    assert t1.table() == {1: array(_INT64, [14])}
+    p.parse_text(text[0:1])
+    assert t.table()['int'] == array(_INT64, [12, 13, 15, 16, 12])
+
+    if numpy is not None:
+        assert t.table(as_numpy=True)['float'].dtype == numpy.float64
+        assert list(t.table(as_numpy=True)['int']) == [12, 13, 15, 16, 12]
+    errors = []
+    saved_numpy, numpy = numpy, None
+    try:
+        for exc_cb in (lambda: t.table(as_numpy=True), lambda: p.add_table_parser(r"(\d+)", [(2, int)]),
+                       lambda: p.add_table_parser(r"(?P<x>\d+)", {'y': int}),
+                       lambda: p.add_table_parser(r"(\d+)", [(1, 'nosuchtype')]),
+                       lambda: p.add_table_parser(r"(\d+)", {})):
+            try:
+                exc_cb()
+            except TextParserException as e:
+                errors.append(e)
+    finally:
+        numpy = saved_numpy
+
+    # a failed conversion drops the rows of the batch, the columns stay aligned
+    p = ptParser()
+    t = p.add_table_parser(r"(?P<int>\w+), (\w+)", [(0, str), ('int', int)])
+    for lines in (["12, a", "x, b"], ["13, c", "%d, d" % 2 ** 64]):
+        p.parse_text(["1, z"])
+        t.table()
+        p.parse_text(lines)
+        try:
+            t.table()
+        except TextParserException as e:
+            errors.append(e)
+    assert t.table() == {0: ["1, z", "1, z"], 'int': array(_INT64, [1, 1])}, t.table()
+    assert len(errors) == 7, errors
+
+    # parse_file() gives the same results as parse_stream() with any number of workers and any parts
+    fd, filename = tempfile.mkstemp(prefix="textparser-")
+    os.close(fd)
+    try:
+        for data in (b"", b"\n", b"x", "\n".join(text * 10).encode('utf-8'),
+                     "\n".join(text * 10 + [""]).encode('utf-8')):
+            with open(filename, 'wb') as f:
+                f.write(data)
+            for match, unique, parse_once, workers, part_size in itertools.product((True, False), (True, False),
+                                                                                   (True, False), (0, 2), (1, 100)):
+                results = []
+                for parallel in (True, False):
+                    seen = []
+                    p = ptParser()
+                    tables = [p.add_table_parser(r"(\w+): ([\d\.]+)", [(1, str), (2, float)])]
+                    for n, regexp in enumerate(regexps):
+                        p.add_row_parser(regexp, lambda m, n=n: seen.append((n, m.group(0))),
+                                         parse_once=parse_once and n != 2)
+                    # the text type: python2 str() can't convert the non-ascii text
+                    tables.append(p.add_table_parser(r"str: (.*)", [(1, type(u""))], parse_once=parse_once))
+                    tables.append(p.add_table_parser(r"(\d+)", [(1, int)]))
+                    if parallel:
+                        ret = p.parse_file(filename, match, unique, workers=workers, part_size=part_size, prefetch=1)
+                    else:
+                        with open(filename, 'rb') as f:
+                            assert p.parse_stream(f, match, unique) == ret
+                    results.append((seen, [t.table() for t in tables]))
+                assert results[0] == results[1], "%s %s" % (str(data[0:10]), (match, unique, parse_once, workers))
+
+        p = ptParser()
+        p.add_row_parser(r"int: (\d+)", lambda m: None)
+        assert p.parse_file(filename, workers=2, part_size=100) is False
+
+        p = ptParser()
+        flush_rows, ptTableParser.flush_rows = ptTableParser.flush_rows, 2
+        t = p.add_table_parser(r"int: (\d+), float: ([\d\.]+)", [(1, int), (2, float)])
+        ptTableParser.flush_rows = flush_rows
+        p.parse_file(filename, workers=2, part_size=100)
+        assert len(t.table()[1]) == 40 and abs(sum(t.table()[2]) - 10 * (1.23 + 1.24 + 1.25 + 1.26)) < 1e-9
+
+        # the workers collect the rows of the lines which only the table parsers match
+        with open(filename, 'wb') as f:
+            f.write(b"int: 1\nstr: a, int: 2\nint: 3, float: 4\nint: 5\n")
+        specs = [(0, r"str: (\w+)", None), (2, r"int: (\d+)", [1]), (3, r"int: (\d+), float: (\d+)", [1, 2])]
+        assert _parse_part(filename, 0, 100, specs, False, False, 'utf-8') == \
+            [([], {2: ["1"]}), (["str: a, int: 2"], {2: ["3", "5"], 3: ["3", "4"]})]
+        assert _parse_part(filename, 7, 100, specs, True, True, 'utf-8') == [(["str: a, int: 2"], {2: ["3", "5"]})]
+
+        # small performance test: the workers scaling, the text lines mostly do not match
+        with open(filename, 'wb') as f:
+            for n in range(0, 200000):
+                f.write(b"2018-01-01 10:00:00 INFO worker-%d handled the request in %d ms\n" % (n % 7, n % 300))
+        for workers in sorted(set([0, 1, 2, multiprocessing.cpu_count()])):
+            p = ptParser()
+            for regexp in regexps:
+                p.add_row_parser(regexp, lambda m: None, parse_once=False)
+            t = time.time()
+            p.parse_file(filename, False, workers=workers, part_size=256 * 1024)
+            print("Parsing rate (%d workers): %.0f lines/sec" % (workers, 200000 / (time.time() - t)))
+
+        # small performance test: the callbacks vs the table parser
+        lines = ["int: %d, float: %d.5, str: s%d" % (n, n, n) for n in range(0, 100000)]
+        t = time.time()
+        p = ptParser()
+        p.add_row_parser(r"int: (?P<int>\d+), float: (?P<float>[\d\.]+), str: (?P<str>.*)", TestClass().parse,
+                         parse_once=False)
+        p.parse_text(lines[0:1000])
+        print("Parsing rate (callbacks): %.0f lines/sec" % (1000 / (time.time() - t)))
+        t = time.time()
+        p = ptParser()
+        table = p.add_table_parser(r"int: (?P<int>\d+), float: (?P<float>[\d\.]+), str: (?P<str>.*)",
+                                   {'int': int, 'float': float, 'str': str})
+        p.parse_text(lines)
+        assert len(table.table()['str']) == len(lines)
+        print("Parsing rate (table parser): %.0f lines/sec" % (len(lines) / (time.time() - t)))
+    finally:
+        os.unlink(filename)
+
     print("OK")
 
 
@@ -10,23 +10,167 @@ __license__ = "MIT"
 """The library to parse time from a text string
 """
 
+import re
 import sys
 import datetime
 import time
+from array import array
 
 FORMATS = ['%Y-%m-%d %H:%M:%S %f', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
            '%b %d %H:%M:%S %f', '%b %d %H:%M:%S.%f', '%b %d %H:%M', '%b %d %H:%M:%S',
            '%b %d %Y %H:%M:%S %f', '%b %d %Y %H:%M:%S.%f', '%b %d %Y %H:%M', '%b %d %Y %H:%M:%S',
            '%b %d %Y %I:%M:%S%p', '%b %d %Y %I:%M%p', '%b %d %Y %I:%M:%S%p %f', '%b %d %Y %I:%M:%S%p.%f']
+_YEARLESS_FORMATS = ('%b %d %H:%M:%S %f', '%b %d %H:%M', '%b %d %H:%M:%S')
+
+MEMO_SIZE = 4096  # max number of the memorized timestamps per TimeParser
+
+
+_MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+
+# the same fields patterns as in the strptime() regexps (see _strptime.TimeRE), except the space padded %d
+_FIELDS = {'Y': r'\d\d\d\d', 'm': r'1[0-2]|0[1-9]|[1-9]', 'd': r'3[0-1]|[1-2]\d|0[1-9]|[1-9]',
+           'H': r'2[0-3]|[0-1]\d|\d', 'I': r'1[0-2]|0[1-9]|[1-9]', 'M': r'[0-5]\d|\d', 'S': r'6[0-1]|[0-5]\d|\d',
+           'f': r'[0-9]{1,6}', 'b': '|'.join(_MONTHS), 'p': r'am|pm'}
+
+
+class _Ints(dict):
+    """
+    str -> int memo, int() is relatively slow. Only for the fields with a limited set of values (not %f)
+    """
+
+    def __missing__(self, key):
+        v = self[key] = int(key)
+        return v
+
+
+_INTS = _Ints()
+
+
+def _microseconds(digits):
+    # %f: '12' is 120000 microseconds
+    if len(digits) <= 3:
+        return _INTS[digits] * 10 ** (6 - len(digits))
+    return int((digits + "00")[0:6])
+
+
+_year = [0, None]  # [expiration time, the current year]
+
+
+def _current_year():
+    """
+    datetime.now().year, refreshed once a minute
+    """
+    now = time.time()
+    if now >= _year[0]:
+        _year[:] = [now + 60, datetime.datetime.now().year]
+    return _year[1]
+
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def _epoch_us(d):
+    """
+    Microseconds since 1970-01-01 00:00:00 of the naive datetime
+    """
+    return ((d.toordinal() - _EPOCH_ORDINAL) * 86400 + d.hour * 3600 + d.minute * 60 + d.second) * 1000000 + \
+        d.microsecond
+
+
+try:
+    _INT64 = array('q').typecode
+except ValueError:  # pragma: no cover
+    _INT64 = 'l'  # python2: no 'q'
+
+_ISO_LENGTHS = {'%Y-%m-%d %H:%M:%S': (19, ), '%Y-%m-%d %H:%M': (16, ), '%Y-%m-%d %H:%M:%S.%f': (23, 26)}
 
 
 class TimeParserException(RuntimeError):
     pass
 
 
+class _TimeFormat:
+    """
+    Compiled strptime() format: the regexp matches the format words at the beginning of a text and the fields
+    are converted to integers directly, so it is an order of magnitude faster than strptime()
+    """
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.words = len(fmt.split())
+        self.year_now = fmt in _YEARLESS_FORMATS
+
+        # the loose pattern is the strptime() regexp without the end anchor: it matches if strptime() can match
+        # the format words at the beginning of a text (see TimeParser.parse())
+        pattern, loose_pattern, fields = "", "", []
+        for n, token in enumerate(re.split(r'(%[a-zA-Z])', fmt)):
+            if n % 2:
+                pattern += "(%s)" % _FIELDS[token[1]]
+                loose_pattern += "(?:%s)" % (_FIELDS[token[1]] + (r'| [1-9]' if token == '%d' else ''))
+                fields.append(token[1])
+            else:
+                words = [re.escape(w) for w in token.split(' ')]
+                pattern += ' '.join(words)
+                loose_pattern += r'\s+'.join(words)
+        self._regexp = re.compile(pattern + r'(?= |\Z)', re.IGNORECASE)
+        self._fields = dict([(f, n) for n, f in enumerate(fields)])
+        # the memo key is the timestamp without the sub-second part (see TimeParser.parse()), %f is the last field
+        self._f_group = self._fields['f'] + 1 if 'f' in self._fields else None
+        self.tail_regexp = re.compile((r'([0-9]{1,6})' if self._f_group else '') + r'(?= |\Z)')
+        self._simple = "".join(fields) in ("YmdHMS", "YmdHM")  # the fields are the datetime() arguments
+        # zero padded fields: the text is in ISO format, datetime.fromisoformat() is the fastest
+        self._iso_lengths = _ISO_LENGTHS.get(fmt, ()) if hasattr(datetime.datetime, 'fromisoformat') else ()
+        self.loose_pattern = loose_pattern
+
+    def parse(self, text):
+        """
+        Returns (datetime, the format length in the text, the memo key length) or (None, None, None)
+        """
+        m = self._regexp.match(text)
+        if not m:
+            return None, None, None
+        n = m.end()
+        g = m.groups()
+        try:
+            if n in self._iso_lengths:
+                d = datetime.datetime.fromisoformat(text[0:n])
+            elif self._simple:
+                d = datetime.datetime(*map(_INTS.__getitem__, g))
+            else:
+                d = self._convert(g)
+        except ValueError:
+            return None, None, None
+        return d, n, m.start(self._f_group) if self._f_group else n
+
+    def _convert(self, g):
+        f = self._fields
+        if 'b' in f:
+            month = _MONTHS.index(g[f['b']].lower()) + 1
+        else:
+            month = _INTS[g[f['m']]]
+        hour = _INTS[g[f['H']]] if 'H' in f else _INTS[g[f['I']]] % 12 + (12 if g[f['p']].lower() == 'pm' else 0)
+        us = _microseconds(g[f['f']]) if 'f' in f else 0
+        d = datetime.datetime(_INTS[g[f['Y']]] if 'Y' in f else 1900, month, _INTS[g[f['d']]], hour,
+                              _INTS[g[f['M']]], _INTS[g[f['S']]] if 'S' in f else 0, us)
+        if self.year_now:
+            d = d.replace(_current_year())
+        return d
+
+
+_TIME_FORMATS = dict([(fmt, _TimeFormat(fmt)) for fmt in FORMATS])
+_LOOSE_REGEXP = re.compile("|".join(["(?:%s)" % f.loose_pattern for f in _TIME_FORMATS.values()]), re.IGNORECASE)
+
+
 class TimeParser:
     def __init__(self):
         self.fmt = None
+        self._fast = None  # _TimeFormat of the last matched format
+        # the fast path format timestamps without the sub-second part -> (datetime or its fields, epoch microseconds)
+        self._memo = {}
+        self._memo_len = 0  # the memo key length of the last parsed timestamp
+        self._lines = 0
+        self._memo_hits = 0
+        self._strptime_lines = 0
         self.words_cnt_guess = 0
         self.words_cnt_max = 0
         self.words_cnt_min = None
@@ -43,8 +187,8 @@ class TimeParser:
 
     def _parse_text(self, fmt, text):
         try:
-            if fmt in ['%b %d %H:%M:%S %f', '%b %d %H:%M', '%b %d %H:%M:%S']:
-                return datetime.datetime.strptime(text, fmt).replace(datetime.datetime.now().year)
+            if fmt in _YEARLESS_FORMATS:
+                return datetime.datetime.strptime(text, fmt).replace(_current_year())
             return datetime.datetime.strptime(text, fmt)
         except ValueError:
             return None
@@ -66,6 +210,99 @@ class TimeParser:
         return None, None
 
     def parse(self, text):
+        self._lines += 1
+        fast = self._fast
+        if fast:
+            # fastest path: the timestamp up to the seconds is the same as in one of the previous lines
+            n = self._memo_len
+            v = self._memo.get(text[0:n])
+            if v is not None:
+                m = fast.tail_regexp.match(text, n)
+                if m:
+                    self._memo_hits += 1
+                    if m.lastindex:
+                        return datetime.datetime(*(v[0] + (_microseconds(m.group(1)), ))), text[m.end():]
+                    return v[0], text[n:]
+
+            # fast path: the last matched format
+            d, n, key_len = fast.parse(text)
+            if d:
+                if len(self._memo) >= MEMO_SIZE:
+                    self._memo.clear()
+                # datetime() arguments without microseconds for the formats with %f, datetime otherwise
+                if key_len < n:
+                    self._memo[text[0:key_len]] = ((d.year, d.month, d.day, d.hour, d.minute, d.second),
+                                                   _epoch_us(d) - d.microsecond)
+                else:
+                    self._memo[text[0:key_len]] = (d, _epoch_us(d))
+                self._memo_len = key_len
+                return d, text[n:]
+
+        if not _LOOSE_REGEXP.match(text):
+            raise TimeParserException("can't parse datetime from: %s" % text)
+
+        self._strptime_lines += 1
+        d, tail = self._parse_strptime(text)
+        fmt = _TIME_FORMATS[self.formats[0]]
+        fmt = fmt if fmt.words == self.words_cnt_guess else None
+        if fmt is not fast:
+            self.reset_memo()
+            self._fast = fmt
+        return d, tail
+
+    def parse_many(self, lines):
+        """
+        Parse a block of lines at once, returns (times, offsets) arrays of 64-bit ints:
+          times[i]   - timestamp of lines[i] in microseconds since 1970-01-01 00:00:00 (the naive datetime of parse())
+          offsets[i] - the tail offset in lines[i] (lines[i][offsets[i]:] is the parse() tail),
+                       -1 if lines[i] has no timestamp (times[i] is 0 then)
+        The memorized timestamps are taken without creating datetime objects. The arrays support the buffer
+        protocol: numpy.frombuffer(times, dtype=numpy.int64) is zero-copy
+        """
+        times = array(_INT64)
+        offsets = array(_INT64)
+        memo = self._memo
+        hits = 0
+        n, tail_match = 0, None
+        for text in lines:
+            if tail_match:
+                v = memo.get(text[0:n])
+                if v is not None:
+                    m = tail_match(text, n)
+                    if m:
+                        hits += 1
+                        times.append(v[1] + _microseconds(m.group(1)) if m.lastindex else v[1])
+                        offsets.append(m.end())
+                        continue
+            try:
+                d, tail = self.parse(text)
+                times.append(_epoch_us(d))
+                offsets.append(len(text) - len(tail))
+            except TimeParserException:
+                times.append(0)
+                offsets.append(-1)
+            n, tail_match = self._memo_len, self._fast.tail_regexp.match if self._fast else None
+
+        self._lines += hits
+        self._memo_hits += hits
+        return times, offsets
+
+    def reset_memo(self):
+        """
+        Forget the memorized timestamps
+        """
+        self._memo.clear()
+        self._memo_len = 0
+
+    def stats(self):
+        """
+        Returns dict with the numbers of the parse() calls ('lines'), the timestamps taken from the memo
+        ('memo_hits', 'memo_hit_ratio') and the lines parsed by strptime() ('strptime')
+        """
+        return {'lines': self._lines, 'memo_hits': self._memo_hits, 'strptime': self._strptime_lines,
+                'memo_hit_ratio': float(self._memo_hits) / self._lines if self._lines else 0.0}
+
+    def _parse_strptime(self, text):
         ar = text.split(' ')
         if len(ar) >= self.words_cnt_guess:
             d, n = self._parse_list(ar, self.words_cnt_guess)
@@ -100,13 +337,88 @@ def _test():
     except TimeParserException:
         pass
 
+    # the compiled formats return the same as strptime()
+    for line in ["2011-07-22 00:00:01 abc", "2011-7-2 0:0:1 abc", "2011-07-22 00:00:01.12 a",
+                 "2011-07-22 00:00:01 12 a", "2011-07-22 00:00:01.123456", "2011-07-22 00:00", "2011-02-30 00:00:01 a",
+                 "2011-07-22 24:00:01 a", "2011-07-22\t00:00:01 a", "2011-07-22  00:00:01 a", "2011-07-22 00:00:01\n",
+                 "may 05 11:45:00 xyz", "May  5 11:45:00 xyz", "Feb 29 11:45 x", "Oct 12 2008 1:33:45PM a",
+                 "Oct 12 2008 12:33AM.5 a", "Oct 12 2008 13:33:45PM a", "Oct 12 2008 11:33:45.3",
+                 "Foo 12 2008 11:33:45"]:
+        results = []
+        for fmt in [None] + FORMATS:
+            for words_cnt_guess in range(0, 6):
+                tp = TimeParser()
+                tp.formats[0], tp.words_cnt_guess = fmt, words_cnt_guess
+                try:
+                    results.append(tp._parse_strptime(line))
+                except TimeParserException:
+                    results.append(None)
+                tp.formats[0], tp.words_cnt_guess = fmt, words_cnt_guess
+                if fmt:
+                    tp._fast = _TIME_FORMATS[fmt] if _TIME_FORMATS[fmt].words == words_cnt_guess else None
+                try:
+                    assert tp.parse(line) == results[-1], "%s, %s, %d" % (line, fmt, words_cnt_guess)
+                except TimeParserException:
+                    assert results[-1] is None
+        print("%s -> %s" % (line.strip(), str(results[0])))
+
+    # the memorized timestamps
+    tp = TimeParser()
+    lines = ["2011-07-22 00:00:01.%s x" % ms for ms in ("1", "12", "123", "1234", "123456", "1234567", "")] + \
+            ["2011-07-22 00:00:01.5", "2011-07-22 00:00:01.5\n", "2011-07-22 00:00:02.5 x", "2011-07-22 00:00:01 x",
+             "May 05 11:45:00 x", "May 05 11:45:00 y", "May 05 11:45:00", "May 05 11:45:00x", "May 05 11:45:01"]
+    for line in lines * 2:
+        try:
+            d = tp.parse(line)
+        except TimeParserException:
+            d = None
+        try:
+            assert d == TimeParser().parse(line), line
+        except TimeParserException:
+            assert d is None, line
+    stats = tp.stats()
+    assert stats['lines'] == len(lines) * 2 and stats['memo_hits'] and stats['strptime'] < len(lines), stats
+    assert stats['memo_hit_ratio'] == float(stats['memo_hits']) / stats['lines']
+
+    # parse_many() gives the same as parse()
+    tp1, tp2 = TimeParser(), TimeParser()
+    times, offsets = tp2.parse_many(lines * 2 + ["x"])
+    assert len(times) == len(offsets) == len(lines) * 2 + 1
+    for n, line in enumerate(lines * 2 + ["x"]):
+        try:
+            d, tail = tp1.parse(line)
+            assert times[n] == _epoch_us(d) and line[offsets[n]:] == tail, line
+            assert datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=times[n]) == d
+        except TimeParserException:
+            assert times[n] == 0 and offsets[n] == -1, line
+    assert tp1.stats() == tp2.stats()
+
+    for n in range(0, MEMO_SIZE + 2):
+        tp.parse("2011-07-22 %02d:%02d:%02d x" % (n // 3600, n // 60 % 60, n % 60))
+    assert 0 < len(tp._memo) < MEMO_SIZE
+    tp.reset_memo()
+    assert tp.parse("2011-07-22 00:00:01 x") == (datetime.datetime(2011, 7, 22, 0, 0, 1), " x")
+    assert tp.parse("2011-07-22 00:00:01 x") == (datetime.datetime(2011, 7, 22, 0, 0, 1), " x")
+    assert tp.stats()['memo_hits'] == stats['memo_hits'] + 1
+
     # small performance test
+    tp = TimeParser()
     lines = 10000
     t = time.time()
     for n in range(0, lines):
         d = tp.parse('2011-07-22 00:00:01 any line here')
     print("Parsing rate: %.0f lines/sec" % (lines / (time.time() - t)))
 
+    t = time.time()
+    for n in range(0, lines):
+        d = tp._parse_strptime('2011-07-22 00:00:01 any line here')
+    print("Parsing rate (strptime): %.0f lines/sec" % (lines / (time.time() - t)))
+
+    block = ['2011-07-22 00:00:01.%03d any line here' % (n % 1000) for n in range(0, lines)]
+    t = time.time()
+    times, offsets = tp.parse_many(block)
+    print("Parsing rate (parse_many): %.0f lines/sec" % (lines / (time.time() - t)))
+
     print("OK")
 
 
@@ -83,7 +83,7 @@ setup(
     # dependencies). You can install these using the following syntax,
     # for example:
     # $ pip install -e .[dev,test]
-    extras_require={'test': ['pycodestyle', 'coverage'], },
+    extras_require={'test': ['pycodestyle', 'coverage'], 'zstd': ['zstandard'], 'numpy': ['numpy'], },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these
@@ -94,5 +94,5 @@ setup(
     package_data={
         '': ['helpers/timeline/*.js', 'helpers/timeline/*.css'],
     },
-    scripts=['tools/pt-suite-uploader.py', 'tools/pt-artifact-ctl.py']
+    scripts=['tools/pt-suite-uploader.py', 'tools/pt-artifact-ctl.py', 'tools/pt-spool-flush.py']
 )
@@ -19,6 +19,8 @@ libs = [("perftrackerlib/client.py", 73),
         ("perftrackerlib/helpers/timehelpers.py", 100),
         ("perftrackerlib/helpers/textparser.py", 100),
         ("perftrackerlib/helpers/html.py", 100),
+        ("perftrackerlib/helpers/spool.py", 90),
+        ("perftrackerlib/helpers/sketch.py", 95),
         ]
 
 
@@ -40,9 +40,7 @@ class formatter(IndentedHelpFormatter):
         return ret
 
 
-def run(opts, args, abort):
-    pt_server = ptServer(opts.pt_server_url)
-
+def run(pt_server, opts, args, abort):
     if len(args) == 0:
         abort("command is not specified")
 
@@ -162,11 +160,16 @@ def main():
             print("error: %s" % msg)
         sys.exit(-1)
 
+    pt_server = ptServer(opts.pt_server_url)
     try:
-        run(opts, args, abort)
+        run(pt_server, opts, args, abort)
     except ptRuntimeException as e:
         logging.error(str(e))
         sys.exit(-1)
+    finally:
+        logging.debug("perftracker connections: %s" %
+                      ", ".join(["%s=%s" % (k, v) for k, v in pt_server.getStats().items()]))
+        pt_server.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+from optparse import OptionParser, IndentedHelpFormatter
+import os
+import sys
+import logging
+
+bindir, basename = os.path.split(sys.argv[0])
+sys.path.insert(0, os.path.join(bindir, ".."))
+
+from perftrackerlib.client import ptServer, ptRuntimeException
+
+from perftrackerlib import perftrackerlib_require_version
+perftrackerlib_require_version('0.1.7')
+
+
+class formatter(IndentedHelpFormatter):
+    def __init__(self):
+        IndentedHelpFormatter.__init__(self, indent_increment=2, max_help_position=30, width=80, short_first=1)
+
+    def format_description(self, description):
+        if not description:
+            return ""
+        ret = "Description:"
+        if description.startswith("\n"):
+            ret += description
+        else:
+            ret += "\n%s\n" % description
+        return ret
+
+
+def main():
+    usage = "usage: %prog [options] SPOOL_DIR [SPOOL_DIR [...]]"
+
+    description = """
+    Replay the job and artifact uploads spooled by --pt-spool-dir=SPOOL_DIR while the portal was unavailable
+    """
+
+    op = OptionParser(description=description, usage=usage, formatter=formatter())
+    op.add_option("-v", "--verbose", default=0, action="count", help="enable verbose mode")
+    op.add_option("-p", "--pt-server-url", default="http://127.0.0.1:9000", help="perftracker url, default %default")
+    op.add_option("-l", "--list", action="store_true", help="list the spooled requests, do not replay them")
+
+    opts, args = op.parse_args()
+
+    loglevel = logging.DEBUG if opts.verbose >= 2 else (logging.INFO if opts.verbose == 1 else logging.WARNING)
+    logging.basicConfig(level=loglevel, format="%(asctime)s - %(module)17s - %(levelname).3s - %(message)s",
+                        datefmt='%H:%M:%S')
+
+    if not args:
+        op.print_usage()
+        print("error: spool directory is not specified")
+        sys.exit(-1)
+
+    ret = 0
+    for spool_dir in args:
+        if not os.path.isdir(spool_dir):
+            print("error: %s is not a directory" % spool_dir)
+            ret = -1
+            continue
+
+        pt_server = ptServer(opts.pt_server_url, spool_dir=spool_dir)
+        spool = pt_server.spool
+
+        if opts.list:
+            for name in spool.entries():
+                meta = spool.get_meta(name)
+                print("%s %6s %s" % (name, meta['method'].upper(), meta['path']))
+            continue
+
+        total = len(spool)
+        try:
+            if not pt_server.flushSpool():
+                ret = -1
+        except ptRuntimeException as e:
+            logging.error(str(e))
+            ret = -1
+        print("%s: %d of %d spooled requests replayed" % (spool_dir, total - len(spool), total))
+        pt_server.close()
+
+    sys.exit(ret)
+
+
+if __name__ == "__main__":
+    main()